@@ -0,0 +1,96 @@
+import random
+
+from PyQt6.QtCore import QObject, QTimer
+
+# +-20% randomization so clients that backed off together don't poll in lockstep
+JITTER = 0.2
+
+
+class AdaptivePoller(QObject):
+    """
+    Replaces a fixed-interval QTimer for one kind of poll.
+
+    The callback starts a request and returns True if it did; the owner calls
+    done() when that request has finished. The next poll is only armed then,
+    so polls never overlap. The interval drops to min_ms after activity and
+    doubles (up to max_ms) after each empty or failed poll. A server hint
+    (X-Poll-Interval) sets a floor and Retry-After delays the next poll.
+
+    Non-essential pollers stop while their widget is hidden or minimized;
+    essential ones keep running at max_ms.
+    """
+
+    def __init__(self, callback, min_ms, max_ms, essential=True, parent=None):
+        super().__init__(parent)
+        self.callback = callback
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.essential = essential
+        self.widget = parent
+        self.interval = min_ms
+        self._outstanding = False
+        self._pending = False
+        self._running = False
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._tick)
+
+    def start(self):
+        self._running = True
+        self.interval = self.min_ms
+        self._arm(0)
+
+    def stop(self):
+        self._running = False
+        self._pending = False
+        self._timer.stop()
+
+    def is_hidden(self):
+        return self.widget is not None and (not self.widget.isVisible() or self.widget.window().isMinimized())
+
+    def poke(self):
+        """Something happened locally: poll now (or right after the current poll) and speed up."""
+        self.interval = self.min_ms
+        if not self._running:
+            return
+        if self._outstanding:
+            self._pending = True
+        else:
+            self._arm(0)
+
+    def done(self, activity=False, hint_ms=None, retry_after=None):
+        """Report the outcome of the poll the callback started."""
+        self._outstanding = False
+        if not self._running:
+            return
+        if activity:
+            self.interval = self.min_ms
+        else:
+            self.interval = min(self.interval * 2, self.max_ms)
+        if self.is_hidden():
+            self.interval = self.max_ms
+        if hint_ms:
+            self.interval = max(self.interval, min(hint_ms, self.max_ms))
+        delay = self.interval * random.uniform(1 - JITTER, 1 + JITTER)
+        if retry_after:
+            delay = max(delay, retry_after * 1000)
+        elif self._pending:
+            delay = 0
+        self._pending = False
+        self._arm(delay)
+
+    def _arm(self, delay_ms):
+        self._timer.start(int(delay_ms))
+
+    def _tick(self):
+        if not self._running:
+            return
+        hidden = self.is_hidden()
+        if hidden and not self.essential:
+            # Paused; only a cheap local visibility check until the widget is shown again
+            self._arm(self.max_ms)
+            return
+        if self.callback():
+            self._outstanding = True
+        else:
+            self._arm(self.max_ms if hidden else self.interval)
@@ -1,16 +1,17 @@
 import sys
+from functools import partial
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel,
     QPushButton, QStackedWidget, QMessageBox, QStatusBar
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QTimer
 from PyQt6.QtGui import QFont
 
+import LocalCache
 import LoginWindow
+import NetworkThread
 import RegistrationWindow
-import ChatWindow
-from FriendsWindow import FriendsPage
-from ProfileWindow import ProfilePage
+# ChatWindow, FriendsWindow and ProfileWindow are imported when their page is first opened
 
 class ChatClient(QMainWindow):
     def __init__(self):
@@ -22,6 +23,7 @@ class ChatClient(QMainWindow):
         self.user_id = None
         self.username = None
         self.tag = None
+        self.cache = None
 
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
@@ -78,25 +80,34 @@ class ChatClient(QMainWindow):
         nav_widget.setStyleSheet("background-color: #1E1F23;")
         nav_widget.setLayout(nav_layout)
         return nav_widget
-    def show_main_ui(self):
+    def close_cache(self):
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+
+    def drop_pages(self):
+        # The pages die with the stacked widget they were added to
         if self.chat_page:
             self.chat_page.stop_timers()
+        if self.friends_page:
+            self.friends_page.stop()
+        self.chat_page = None
+        self.friends_page = None
+        self.profile_page = None
+
+    def show_main_ui(self):
+        self.drop_pages()
+
+        self.close_cache()
+        self.cache = LocalCache.LocalCache(self.user_id)
 
         self.nav_widget = self.create_navigation()
 
+        # Only the home page is built now; the others are created on first navigation
         self.stacked_widget = QStackedWidget()
         self.home_page = QLabel(f"🏠 Welcome {self.username}!", alignment=Qt.AlignmentFlag.AlignCenter)
         self.home_page.setFont(QFont("Arial", 24, QFont.Weight.Bold))
-
-        self.chat_page = ChatWindow.ChatWindow(self)
-        self.profile_page = ProfilePage(self.user_id, self.username, self.tag)
-
-        self.friends_page = FriendsPage(username = self.username, user_id=self.user_id, user_tag=self.tag)
-
         self.stacked_widget.addWidget(self.home_page)
-        self.stacked_widget.addWidget(self.chat_page)
-        self.stacked_widget.addWidget(self.friends_page)  # اضافه کردن صفحه دوستان به استک
-        self.stacked_widget.addWidget(self.profile_page)
 
         main_layout = QHBoxLayout()
         main_layout.setContentsMargins(0, 0, 0, 0)
@@ -109,11 +120,46 @@ class ChatClient(QMainWindow):
 
         self.open_home_page()
         self.status_bar.showMessage(f"Logged in as {self.username}")
+        QTimer.singleShot(0, self.warm_friends)
+
+    def warm_friends(self):
+        """Fetch the friends overview in the background so the Friends page opens from the cache."""
+        if self.cache is None or self.friends_page is not None:
+            return
+        self.friends_warmup = NetworkThread.shared_request("friends/overview")
+        self.friends_warmup.data_received.connect(partial(self.friends_warmed, self.cache))
+
+    def friends_warmed(self, cache, data):
+        # Ignore answers that land after a logout or a re-login
+        if cache is self.cache and isinstance(data, dict):
+            cache.save_friends(data.get("friends", []))
+
+    def ensure_chat_page(self):
+        if self.chat_page is None:
+            import ChatWindow
+            self.chat_page = ChatWindow.ChatWindow(self)
+            self.stacked_widget.addWidget(self.chat_page)
+        return self.chat_page
+
+    def ensure_friends_page(self):
+        if self.friends_page is None:
+            from FriendsWindow import FriendsPage
+            self.friends_page = FriendsPage(username=self.username, user_id=self.user_id,
+                                            user_tag=self.tag, cache=self.cache)
+            self.stacked_widget.addWidget(self.friends_page)
+        return self.friends_page
+
+    def ensure_profile_page(self):
+        if self.profile_page is None:
+            from ProfileWindow import ProfilePage
+            self.profile_page = ProfilePage(self.user_id, self.username, self.tag)
+            self.stacked_widget.addWidget(self.profile_page)
+        return self.profile_page
 
     def open_friends_page(self):
         if self.chat_page:
             self.chat_page.stop_timers()
-        self.stacked_widget.setCurrentWidget(self.friends_page)
+        self.stacked_widget.setCurrentWidget(self.ensure_friends_page())
         self.status_bar.showMessage("Viewing your friends.")
 
     def open_home_page(self):
@@ -123,14 +169,14 @@ class ChatClient(QMainWindow):
         self.status_bar.showMessage("You're at home.")
 
     def open_chat_page(self):
-        self.stacked_widget.setCurrentWidget(self.chat_page)
+        self.stacked_widget.setCurrentWidget(self.ensure_chat_page())
         self.chat_page.start_timers_and_initial_fetch()
         self.status_bar.showMessage("You're now in the chat room.")
 
     def open_profile_page(self):
         if self.chat_page:
             self.chat_page.stop_timers()
-        self.stacked_widget.setCurrentWidget(self.profile_page)
+        self.stacked_widget.setCurrentWidget(self.ensure_profile_page())
         self.status_bar.showMessage("Viewing your profile.")
 
     def handle_logout(self):
@@ -140,14 +186,18 @@ class ChatClient(QMainWindow):
         if confirm == QMessageBox.StandardButton.Yes:
             self.user_id = None
             self.username = None
-            if self.chat_page:
-                self.chat_page.stop_timers()
+            self.drop_pages()
+            self.close_cache()
+            self.logout_thread = NetworkThread.NetworkThread("logout", {}, "POST")
+            self.logout_thread.finished.connect(lambda: NetworkThread.set_auth_token(None))
+            self.logout_thread.start()
             self.show_login_ui()
             self.status_bar.showMessage("Logged out.", 3000)
 
     def closeEvent(self, event):
-        if self.chat_page:
-            self.chat_page.stop_timers()
+        self.drop_pages()
+        NetworkThread.shutdown()
+        self.close_cache()
         self.status_bar.showMessage("Goodbye!")
         event.accept()
     
@@ -164,12 +214,6 @@ class ChatClient(QMainWindow):
         else:
             print(f"Unknown page: {page_name}")
 
-    def open_friends_page(self):
-        if self.chat_page:
-            self.chat_page.stop_timers()
-        self.stacked_widget.setCurrentWidget(self.friends_page)
-        self.status_bar.showMessage("Viewing your friends.")
-
     def show_login_ui(self):
         self.login_widget = LoginWindow.LoginWindow(self)
         self.setCentralWidget(self.login_widget)
@@ -180,12 +224,6 @@ class ChatClient(QMainWindow):
         self.setCentralWidget(self.registration_widget)
         self.status_bar.showMessage("Create a new account.")
 
-    def open_friends_page(self):
-        if self.chat_page:
-            self.chat_page.stop_timers()
-        self.stacked_widget.setCurrentWidget(self.friends_page)
-        self.status_bar.showMessage("Viewing your friends.")
-
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = ChatClient()
@@ -1,22 +1,19 @@
-import html
-from datetime import datetime
-import pytz
-import jdatetime
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel,
-                             QLineEdit, QPushButton, QTextEdit, QListWidget,
+                             QLineEdit, QPushButton, QListWidget, QListView,
                              QMessageBox)
 from PyQt6.QtCore import QTimer, Qt
-from PyQt6.QtGui import QFont, QTextCursor
+from PyQt6.QtGui import QFont
 
 import NetworkThread
+from AdaptivePoller import AdaptivePoller
+from MessageList import MessageModel, MessageDelegate, MessageListView
+from TimeFormat import format_timestamps
 
-
-def to_tehran_time_persian(utc_iso_string):
-    utc_dt = datetime.fromisoformat(utc_iso_string.replace('Z', '+00:00'))
-    tehran = pytz.timezone('Asia/Tehran')
-    tehran_dt = utc_dt.astimezone(tehran)
-    jdate = jdatetime.datetime.fromgregorian(datetime=tehran_dt)
-    return jdate.strftime('%Y/%m/%d %H:%M')
+# Poll intervals: (fastest, slowest when idle) in ms
+MESSAGES_POLL_MS = (1000, 8000)
+USERS_POLL_MS = (5000, 60000)
+ACTIVITY_PING_MS = 20000
+OLDER_PAGE_SIZE = 50
 
 
 class ChatWindow(QWidget):
@@ -24,8 +21,16 @@ class ChatWindow(QWidget):
         super().__init__(parent)
         self.parent_app = parent
         self.last_message_id = 0
+        self.messages_thread = None
+        self.users_thread = None
+        self.activity_thread = None
+        self.older_thread = None
+        self.history_exhausted = False
+        self.online_usernames = []
+        self.cache = getattr(parent, "cache", None)
         self.setup_ui()
         self.setup_timers()
+        self.show_cached_messages()
 
     def setup_ui(self):
         main_layout = QHBoxLayout()
@@ -46,9 +51,12 @@ class ChatWindow(QWidget):
         right_panel.addStretch(1)
 
         chat_layout = QVBoxLayout()
-        self.chat_display = QTextEdit()
-        self.chat_display.setReadOnly(True)
-        self.chat_display.setFont(QFont("Consolas", 11))
+        # Only the visible rows are laid out and painted; see MessageList
+        self.message_model = MessageModel(parent=self)
+        self.chat_display = MessageListView()
+        self.chat_display.setModel(self.message_model)
+        self.chat_display.setItemDelegate(MessageDelegate(self.chat_display))
+        self.chat_display.older_requested.connect(self.load_older_messages)
         self.chat_display.setStyleSheet("""
             background-color: #2B2D31;
             color: #ddd;
@@ -88,24 +96,22 @@ class ChatWindow(QWidget):
         self.message_input.returnPressed.connect(self.send_message)
 
     def setup_timers(self):
-        self.update_messages_timer = QTimer(self)
-        self.update_messages_timer.timeout.connect(self.update_messages)
-        self.update_users_timer = QTimer(self)
-        self.update_users_timer.timeout.connect(self.update_users)
+        self.messages_poller = AdaptivePoller(self.update_messages, *MESSAGES_POLL_MS, parent=self)
+        # The online list is only decoration, it stops while the chat is not on screen
+        self.users_poller = AdaptivePoller(self.update_users, *USERS_POLL_MS, essential=False, parent=self)
+        # Presence must keep its fixed cadence or the user drops out of the online list
         self.activity_ping_timer = QTimer(self)
         self.activity_ping_timer.timeout.connect(self.send_activity_ping)
 
     def start_timers_and_initial_fetch(self):
-        self.update_messages_timer.start(1000)
-        self.update_users_timer.start(5000)
-        self.activity_ping_timer.start(20000)
-        self.update_messages()
-        self.update_users()
+        self.messages_poller.start()
+        self.users_poller.start()
+        self.activity_ping_timer.start(ACTIVITY_PING_MS)
         self.send_activity_ping()
 
     def stop_timers(self):
-        self.update_messages_timer.stop()
-        self.update_users_timer.stop()
+        self.messages_poller.stop()
+        self.users_poller.stop()
         self.activity_ping_timer.stop()
 
         for thread in [
@@ -115,67 +121,112 @@ class ChatWindow(QWidget):
             getattr(self, 'activity_thread', None)
         ]:
             if thread and thread.isRunning():
-                thread.quit()
-                thread.wait()
+                thread.cancel()
 
     def closeEvent(self, event):
         self.stop_timers()
         event.accept()
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        # Catch up right away instead of waiting out an idle interval
+        self.messages_poller.poke()
+        self.users_poller.poke()
+
+    @staticmethod
+    def _in_flight(task):
+        return task is not None and task.isRunning()
+
     def update_messages(self):
-        if self.parent_app.user_id is None:
-            return
-        self.messages_thread = NetworkThread.NetworkThread(
-            f"messages?last_id={self.last_message_id}&limit=50",
-            parent=self
+        # Called by messages_poller, which never starts a poll while one is outstanding;
+        # the cursor only moves when that poll's response is applied.
+        if self.parent_app.user_id is None or self._in_flight(self.messages_thread):
+            return False
+        cursor = self.last_message_id
+        self.messages_thread = NetworkThread.shared_request(
+            "messages", {"last_id": cursor, "limit": 50}
         )
         self.messages_thread.data_received.connect(self.update_messages_display)
         self.messages_thread.error_occurred.connect(lambda e: print(f"Error updating messages: {e}"))
-        self.messages_thread.start()
-
-    def update_messages_display(self, messages_data):
+        self.messages_thread.finished.connect(
+            lambda task=self.messages_thread: self.messages_poller.done(
+                activity=self.last_message_id > cursor,
+                hint_ms=task.poll_interval,
+                retry_after=task.retry_after
+            )
+        )
+        return True
+
+    def show_cached_messages(self):
+        # Render what the last session already downloaded; polling then resumes from its cursor
+        if self.cache:
+            self.update_messages_display(self.cache.recent_messages(), store=False)
+
+    def to_rows(self, messages):
+        me = f"{self.parent_app.username}#{self.parent_app.tag}"
+        times = format_timestamps([msg.get('timestamp', '') for msg in messages])
+        return [{
+            "id": msg.get('id'),
+            "sender": msg.get('sender', 'Unknown'),
+            "text": msg.get('message', ''),
+            "time": time,
+            "mine": msg.get('sender') == me,
+        } for msg, time in zip(messages, times)]
+
+    def update_messages_display(self, messages_data, store=True):
         if not isinstance(messages_data, list):
             print(f"Expected list, got {type(messages_data)}")
             return
 
-        sorted_messages = sorted(messages_data, key=lambda x: x.get('id', 0))
-        max_message_id = self.last_message_id
-
-        scrollbar = self.chat_display.verticalScrollBar()
-        at_bottom = scrollbar.value() >= (scrollbar.maximum() - 30)
-
-        html_content = ""
-        for msg in sorted_messages:
-            msg_id = msg.get('id')
-            if not msg_id or msg_id <= self.last_message_id:
-                continue
-
-            timestamp = to_tehran_time_persian(msg.get('timestamp', ''))
-            sender_name = msg.get('sender', 'Unknown')
-            message_text = html.escape(msg.get('message', ''))
-
-            if sender_name == self.parent_app.username + "#" + self.parent_app.tag:
-                line = (f'<div align="right">'
-                        f'<b style="color:#4CAF50;">You:</b> {message_text}'
-                        f'<br><span style="font-size:10px;color:#888;">{timestamp}</span>'
-                        f'</div><hr style="border:none;height:1px;background:#444;">')
-            else:
-                line = (f'<div align="left">'
-                        f'<b style="color:#2196F3;">{sender_name}:</b> {message_text}'
-                        f'<br><span style="font-size:10px;color:#888;">{timestamp}</span>'
-                        f'</div><hr style="border:none;height:1px;background:#444;">')
+        fresh = [msg for msg in sorted(messages_data, key=lambda x: x.get('id', 0))
+                 if msg.get('id') and msg['id'] > self.last_message_id]
+        if not fresh:
+            return
 
-            html_content += line
-            max_message_id = max(max_message_id, msg_id)
+        at_bottom = self.chat_display.is_at_bottom()
+        self.message_model.append_rows(self.to_rows(fresh))
+        self.last_message_id = fresh[-1]['id']
+        if store and self.cache:
+            self.cache.add_messages(fresh)
 
-        if html_content:
-            self.chat_display.moveCursor(QTextCursor.MoveOperation.End)
-            self.chat_display.insertHtml(html_content)
+        if at_bottom:
+            self.chat_display.scrollToBottom()
 
-        self.last_message_id = max_message_id
+    def load_older_messages(self):
+        # Scrolled to the top: prepend the previous page, from the local cache when it has it
+        if self._in_flight(self.older_thread) or self.history_exhausted or self.message_model.is_full():
+            return
+        before_id = self.message_model.oldest_id()
+        if not before_id:
+            return
+        cached = self.cache.messages_before(before_id, OLDER_PAGE_SIZE) if self.cache else []
+        if cached:
+            self.prepend_older_messages(cached)
+            return
+        self.older_thread = NetworkThread.shared_request(
+            "messages", {"before_id": before_id, "limit": OLDER_PAGE_SIZE}
+        )
+        self.older_thread.data_received.connect(self.older_messages_received)
+        self.older_thread.error_occurred.connect(lambda e: print(f"Error loading older messages: {e}"))
 
-        if at_bottom:
-            scrollbar.setValue(scrollbar.maximum())
+    def older_messages_received(self, messages_data):
+        if not isinstance(messages_data, list):
+            return
+        if not messages_data:
+            self.history_exhausted = True
+            return
+        if self.cache:
+            self.cache.add_messages(messages_data)
+        self.prepend_older_messages(messages_data)
+
+    def prepend_older_messages(self, messages):
+        oldest = self.message_model.oldest_id()
+        rows = self.to_rows([msg for msg in sorted(messages, key=lambda x: x.get('id', 0))
+                             if msg.get('id') and msg['id'] < oldest])
+        added = self.message_model.prepend_rows(rows)
+        if added:
+            # Keep the message that was at the top in place instead of jumping to the new first row
+            self.chat_display.scrollTo(self.message_model.index(added), QListView.ScrollHint.PositionAtTop)
 
     def send_message(self):
         message = self.message_input.text().strip()
@@ -191,7 +242,7 @@ class ChatWindow(QWidget):
 
         self.send_message_thread = NetworkThread.NetworkThread(
             "messages/send",
-            {"sender_id": self.parent_app.user_id, "message": message},
+            {"message": message},
             "POST",
             parent=self
         )
@@ -204,23 +255,36 @@ class ChatWindow(QWidget):
         self.message_input.clear()
         self.message_input.setFocus()
         self.parent_app.status_bar.showMessage("Message sent.", 2000)
-        self.update_messages()
+        self.messages_poller.poke()
 
     def update_users(self):
-        self.users_thread = NetworkThread.NetworkThread("users/online", parent=self)
+        if self._in_flight(self.users_thread):
+            return False
+        before = self.online_usernames
+        self.users_thread = NetworkThread.shared_request("users/online")
         self.users_thread.data_received.connect(self.update_users_list)
         self.users_thread.error_occurred.connect(lambda e: print(f"Error updating users: {e}"))
-        self.users_thread.start()
+        self.users_thread.finished.connect(
+            lambda task=self.users_thread: self.users_poller.done(
+                activity=self.online_usernames != before,
+                hint_ms=task.poll_interval,
+                retry_after=task.retry_after
+            )
+        )
+        return True
 
     def update_users_list(self, users_data):
+        self.online_usernames = [user.get('username', 'Unknown') for user in users_data]
         self.online_users_list.clear()
-        for user in users_data:
-            self.online_users_list.addItem(user.get('username', 'Unknown'))
+        for username in self.online_usernames:
+            self.online_users_list.addItem(username)
 
     def send_activity_ping(self):
+        if self._in_flight(self.activity_thread):
+            return
         self.activity_thread = NetworkThread.NetworkThread(
             "/users/activity",
-            {"user_id": self.parent_app.user_id},
+            {},
             "POST",
             parent=self
         )
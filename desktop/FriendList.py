@@ -0,0 +1,161 @@
+from PyQt6.QtWidgets import QListView, QStyledItemDelegate, QAbstractItemView, QStyle
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QSize, QEvent, pyqtSignal
+from PyQt6.QtGui import QColor, QPainter
+
+RowRole = Qt.ItemDataRole.UserRole + 1
+
+ROW_HEIGHT = 34
+BUTTON_WIDTH = 56
+BUTTON_GAP = 6
+MARGIN = 5
+
+
+class FriendListModel(QAbstractListModel):
+    """
+    Rows are dicts with at least "key" and "text"; "actions" is a list of
+    (action, label, color) buttons the delegate paints. set_rows() diffs
+    against the current rows by key, so a refresh only inserts, removes or
+    repaints the rows that actually changed.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self._rows[index.row()]
+        if role == RowRole:
+            return row
+        if role == Qt.ItemDataRole.DisplayRole:
+            return row["text"]
+        return None
+
+    def row(self, i):
+        return self._rows[i]
+
+    def set_rows(self, rows):
+        new_keys = [r["key"] for r in rows]
+        wanted = set(new_keys)
+        if len(wanted) != len(new_keys) or len({r["key"] for r in self._rows}) != len(self._rows):
+            # Keys must be unique to diff by them
+            self.beginResetModel()
+            self._rows = list(rows)
+            self.endResetModel()
+            return
+
+        # 1. Drop rows that are gone, bottom-up in contiguous runs
+        i = len(self._rows) - 1
+        while i >= 0:
+            if self._rows[i]["key"] in wanted:
+                i -= 1
+                continue
+            end = i
+            while i >= 0 and self._rows[i]["key"] not in wanted:
+                i -= 1
+            self.beginRemoveRows(QModelIndex(), i + 1, end)
+            del self._rows[i + 1:end + 1]
+            self.endRemoveRows()
+
+        # 2. What is left must appear in the new order; otherwise reordering is not worth diffing
+        position = {key: n for n, key in enumerate(new_keys)}
+        kept = [position[r["key"]] for r in self._rows]
+        if kept != sorted(kept):
+            self.beginResetModel()
+            self._rows = list(rows)
+            self.endResetModel()
+            return
+
+        # 3. Walk the new list: update rows in place, insert runs of new ones
+        i = 0
+        while i < len(rows):
+            if i < len(self._rows) and self._rows[i]["key"] == rows[i]["key"]:
+                if self._rows[i] != rows[i]:
+                    self._rows[i] = rows[i]
+                    index = self.index(i)
+                    self.dataChanged.emit(index, index)
+                i += 1
+                continue
+            start = i
+            current = self._rows[i]["key"] if i < len(self._rows) else None
+            while i < len(rows) and rows[i]["key"] != current:
+                i += 1
+            self.beginInsertRows(QModelIndex(), start, i - 1)
+            self._rows[start:start] = rows[start:i]
+            self.endInsertRows()
+
+
+class FriendDelegate(QStyledItemDelegate):
+    """Paints the row text and its action buttons; clicks on a button emit action_triggered."""
+    action_triggered = pyqtSignal(str, object)
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), ROW_HEIGHT)
+
+    def _button_rects(self, rect, row):
+        rects = []
+        right = rect.right() - MARGIN
+        for action in reversed(row.get("actions", [])):
+            rects.append((action, QRect(right - BUTTON_WIDTH, rect.top() + 4, BUTTON_WIDTH, rect.height() - 8)))
+            right -= BUTTON_WIDTH + BUTTON_GAP
+        return rects[::-1]
+
+    def paint(self, painter, option, index):
+        row = index.data(RowRole)
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        if option.state & QStyle.StateFlag.State_MouseOver:
+            painter.fillRect(option.rect, option.palette.alternateBase())
+
+        buttons = self._button_rects(option.rect, row)
+        text_right = buttons[0][1].left() - BUTTON_GAP if buttons else option.rect.right() - MARGIN
+        text_rect = QRect(option.rect.left() + MARGIN, option.rect.top(),
+                          text_right - option.rect.left() - MARGIN, option.rect.height())
+        painter.setPen(option.palette.text().color())
+        elided = option.fontMetrics.elidedText(row["text"], Qt.TextElideMode.ElideRight, text_rect.width())
+        painter.drawText(text_rect, Qt.AlignmentFlag.AlignVCenter | Qt.AlignmentFlag.AlignLeft, elided)
+
+        for (action, label, color), rect in buttons:
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(QColor(color))
+            painter.drawRoundedRect(rect, 4, 4)
+            painter.setPen(QColor("black"))
+            painter.drawText(rect, Qt.AlignmentFlag.AlignCenter, label)
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.Type.MouseButtonRelease and event.button() == Qt.MouseButton.LeftButton:
+            row = index.data(RowRole)
+            for (action, _, _), rect in self._button_rects(option.rect, row):
+                if rect.contains(event.position().toPoint()):
+                    self.action_triggered.emit(action, row)
+                    return True
+        return super().editorEvent(event, model, option, index)
+
+
+class FriendListView(QListView):
+    """QListView that shows a placeholder line ("Loading...", "No friends found.") while empty."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.placeholder = ""
+        self.setUniformItemSizes(True)
+        self.setMouseTracking(True)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+
+    def set_placeholder(self, text):
+        self.placeholder = text
+        self.viewport().update()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.model() is not None and self.model().rowCount() == 0 and self.placeholder:
+            painter = QPainter(self.viewport())
+            painter.setPen(self.palette().placeholderText().color())
+            painter.drawText(self.viewport().rect().adjusted(MARGIN, MARGIN, -MARGIN, -MARGIN),
+                             Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft, self.placeholder)
+            painter.end()
@@ -1,22 +1,25 @@
 from PyQt6.QtWidgets import (
-    QWidget, QVBoxLayout, QListWidget, QPushButton, QMessageBox,
-    QTabWidget, QLabel, QLineEdit, QHBoxLayout, QListWidgetItem, QStackedLayout  
+    QWidget, QVBoxLayout, QPushButton, QMessageBox,
+    QTabWidget, QLabel, QLineEdit, QStackedLayout, QCompleter
 )
+from PyQt6.QtCore import QTimer, QStringListModel, Qt
 import requests
 from functools import partial
 from PrivateChat import PrivateChatWidget  # جدید
-from NetworkThread import NetworkThread
+from FriendList import FriendListModel, FriendDelegate, FriendListView
+import NetworkThread
+from NetworkThread import api_request, decode_response
 
-SERVER_URL = "http://localhost:5000/api"  # Base API URL
+SEARCH_DEBOUNCE_MS = 250
 
 class FriendsPage(QWidget):
-    def __init__(self,username, user_id, user_tag, parent=None):
+    def __init__(self,username, user_id, user_tag, parent=None, cache=None):
 
         super().__init__(parent)
+        self.cache = cache
         self.user_id = user_id
         self.user_tag = user_tag 
         self.username = username
-        self.NetworkThread = NetworkThread
         self.main_layout = QVBoxLayout(self)
         self.setLayout(self.main_layout)
 
@@ -36,7 +39,7 @@ class FriendsPage(QWidget):
         self.online_tab = QWidget()
         self.online_layout = QVBoxLayout()
         self.online_tab.setLayout(self.online_layout)
-        self.online_list = QListWidget()
+        self.online_list, self.online_model = self.make_list()
         self.online_refresh_btn = QPushButton("Refresh Online Friends")
         self.online_refresh_btn.clicked.connect(self.load_online_friends)
         self.online_layout.addWidget(self.online_list)
@@ -47,7 +50,7 @@ class FriendsPage(QWidget):
         self.all_tab = QWidget()
         self.all_layout = QVBoxLayout()
         self.all_tab.setLayout(self.all_layout)
-        self.all_list = QListWidget()
+        self.all_list, self.all_model = self.make_list()
         self.all_refresh_btn = QPushButton("Refresh All Friends")
         self.all_refresh_btn.clicked.connect(self.load_all_friends)
         self.all_layout.addWidget(self.all_list)
@@ -58,7 +61,7 @@ class FriendsPage(QWidget):
         self.requests_tab = QWidget()
         self.requests_layout = QVBoxLayout()
         self.requests_tab.setLayout(self.requests_layout)
-        self.requests_list = QListWidget()
+        self.requests_list, self.requests_model = self.make_list()
         self.requests_refresh_btn = QPushButton("Refresh Friend Requests")
         self.requests_refresh_btn.clicked.connect(self.load_friend_requests)
         self.requests_layout.addWidget(self.requests_list)
@@ -71,6 +74,20 @@ class FriendsPage(QWidget):
         self.add_tab.setLayout(self.add_layout)
         self.add_label = QLabel("Enter friend ID (e.g. Username#1234):")
         self.add_input = QLineEdit()
+        self.add_input.setPlaceholderText("Start typing a username...")
+
+        # Typeahead: query the server only after the user pauses typing
+        self.search_model = QStringListModel(self)
+        self.search_completer = QCompleter(self.search_model, self)
+        self.search_completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        self.add_input.setCompleter(self.search_completer)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.run_user_search)
+        self.add_input.textEdited.connect(lambda _: self.search_timer.start())
+        self.search_thread = None
+
         self.add_button = QPushButton("Send Friend Request")
         self.add_button.clicked.connect(self.send_friend_request)
         self.add_layout.addWidget(self.add_label)
@@ -78,123 +95,153 @@ class FriendsPage(QWidget):
         self.add_layout.addWidget(self.add_button)
         self.tabs.addTab(self.add_tab, "Add Friend")
 
-        # Load initial data
+        # Load initial data in the background; the lists show placeholders until it lands
+        self.online_thread = None
+        self.all_thread = None
+        self.requests_thread = None
+        self.overview_thread = None
+        self.private_chat = None
+        self.prefetch()
+
+    def stop(self):
+        # Called before the page (and the cache it writes to) goes away, e.g. on logout
+        self.search_timer.stop()
+        for task in (self.overview_thread, self.online_thread, self.all_thread,
+                     self.requests_thread, self.search_thread):
+            if task is not None and task.isRunning():
+                task.cancel()
+        if self.private_chat is not None:
+            self.private_chat.stop()
+
+    def make_list(self):
+        # Model/view list: rows are painted by the delegate, refreshes are diffed by key
+        model = FriendListModel(self)
+        view = FriendListView()
+        view.setModel(model)
+        delegate = FriendDelegate(view)
+        delegate.action_triggered.connect(self.on_row_action)
+        view.setItemDelegate(delegate)
+        return view, model
+
+    @staticmethod
+    def show_placeholder(list_view, text="Loading..."):
+        # Rows already on screen stay until the refreshed list replaces them
+        list_view.set_placeholder(text)
+
+    def prefetch(self):
+        for list_view in (self.online_list, self.all_list, self.requests_list):
+            self.show_placeholder(list_view)
+        if self.cache and self.cache.friends() is not None:
+            self.show_all_friends(self.cache.friends())
+        self.overview_thread = NetworkThread.shared_request("friends/overview")
+        self.overview_thread.data_received.connect(self.show_overview)
+        # Older servers without the combined endpoint: fetch the three lists in parallel
+        self.overview_thread.error_occurred.connect(lambda _: self.refresh_all())
+
+    def show_overview(self, data):
+        if not isinstance(data, dict):
+            self.refresh_all()
+            return
+        self.show_online_friends(data.get("online", []))
+        self.show_all_friends(data.get("friends", []))
+        if self.cache:
+            self.cache.save_friends(data.get("friends", []))
+        self.show_friend_requests(data.get("requests", []))
+
+    def refresh_all(self):
         self.load_online_friends()
         self.load_all_friends()
         self.load_friend_requests()
 
     def load_online_friends(self):
-        self.online_list.clear()
-        try:
-            friends = self.fetch_online_friends()
-            if not friends:
-                self.online_list.addItem("No online friends.")
-            else:
-                for f in friends:
-                    friend_username = f.get('username', 'Unknown')
-                    friend_since = f.get('since', 'N/A')
-                    friend_id = f.get('id')  # فرض می‌کنیم شناسه فرند اینجاست
-
-                    # ویجت سفارشی هر ردیف
-                    item_widget = QWidget()
-                    layout = QHBoxLayout(item_widget)
-                    layout.setContentsMargins(5, 0, 5, 0)
-
-                    label = QLabel(f"{friend_username} 🤝 | Since: {friend_since}")
-                    btn_chat = QPushButton("Chat")
-                    btn_chat.setStyleSheet("background-color: lightblue;")
-
-                    # وصل کردن دکمه چت به تابع باز کردن صفحه چت با آن دوست
-                    btn_chat.clicked.connect(partial(self.open_private_chat, friend_id, friend_username))
-
-                    layout.addWidget(label)
-                    layout.addStretch()
-                    layout.addWidget(btn_chat)
-
-                    item = QListWidgetItem()
-                    item.setSizeHint(item_widget.sizeHint())
+        if self.online_thread is not None and self.online_thread.isRunning():
+            return
+        self.show_placeholder(self.online_list)
+        self.online_thread = NetworkThread.shared_request("friends/online")
+        self.online_thread.data_received.connect(self.show_online_friends)
+        self.online_thread.error_occurred.connect(
+            lambda e: self.show_placeholder(self.online_list, f"Failed to load online friends: {e}")
+        )
 
-                    self.online_list.addItem(item)
-                    self.online_list.setItemWidget(item, item_widget)
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to load online friends:\n{e}")
+    def show_online_friends(self, friends):
+        self.online_model.set_rows([{
+            "key": f.get('id'),
+            "id": f.get('id'),
+            "username": f.get('username', 'Unknown'),
+            "text": f"{f.get('username', 'Unknown')} 🤝 | Since: {f.get('since', 'N/A')}",
+            "actions": [("chat", "Chat", "lightblue")],
+        } for f in friends or []])
+        self.online_list.set_placeholder("No online friends.")
 
     def load_all_friends(self):
-        self.all_list.clear()
-        try:
-            friends = self.fetch_all_friends()
-            if not friends:
-                self.all_list.addItem("No friends found.")
-            else:
-                for f in friends:
-                    user_name = self.username
-                    friend_name = f.get('username', 'Unknown')
-                    since = f.get('friended_at', 'N/A')
-                    self.all_list.addItem(f"{user_name} 🤝 {friend_name} | Since: {since}")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to load all friends:\n{e}")
+        if self.all_thread is not None and self.all_thread.isRunning():
+            return
+        self.show_placeholder(self.all_list)
+        self.all_thread = NetworkThread.shared_request("friends/all")
+        self.all_thread.data_received.connect(self.all_friends_loaded)
+        self.all_thread.error_occurred.connect(self.all_friends_failed)
+
+    def all_friends_loaded(self, friends):
+        if self.cache and isinstance(friends, list):
+            self.cache.save_friends(friends)
+        self.show_all_friends(friends)
+
+    def all_friends_failed(self, error):
+        # Offline or server down: fall back to the last list we downloaded
+        cached = self.cache.friends() if self.cache else None
+        if cached is not None:
+            self.show_all_friends(cached)
+        else:
+            self.show_placeholder(self.all_list, f"Failed to load all friends: {error}")
+
+    def show_all_friends(self, friends):
+        self.all_model.set_rows([{
+            "key": f.get('username', 'Unknown'),
+            "text": f"{self.username} 🤝 {f.get('username', 'Unknown')} | Since: {f.get('friended_at', 'N/A')}",
+        } for f in friends or []])
+        self.all_list.set_placeholder("No friends found.")
 
     def load_friend_requests(self):
-        self.requests_list.clear()
-        try:
-            requests = self.fetch_friend_requests()
-            # print("Friend requests data:", requests)  # <--- چک کردن داده دریافتی
-            if not requests:
-                self.requests_list.addItem("No pending friend requests.")
-            else:
-                for r in requests:
-                    requester_id = r.get('from_user')
-                    print("requester_id:", requester_id)  # <--- چک کردن تک تک آی‌دی‌ها
-                    from_user = r.get('from_user', "unknown")
-                    requested_at = r.get('requested_at', 'N/A')
-
-                    item_widget = QWidget()
-                    layout = QHBoxLayout(item_widget)
-                    layout.setContentsMargins(5, 0, 5, 0)
-
-                    label = QLabel(f"From {from_user} ({requested_at})")
-                    btn_accept = QPushButton("✔")
-                    btn_reject = QPushButton("✖")
-
-                    btn_accept.setStyleSheet("background-color: lightgreen;")
-                    btn_reject.setStyleSheet("background-color: lightcoral;")
-
-                    # اتصال صحیح
-                    btn_accept.clicked.connect(partial(self.accept_request, requester_id))
-                    btn_reject.clicked.connect(partial(self.reject_request, requester_id))
-
-                    layout.addWidget(label)
-                    layout.addStretch()
-                    layout.addWidget(btn_accept)
-                    layout.addWidget(btn_reject)
-
-                    item = QListWidgetItem()
-                    item.setSizeHint(item_widget.sizeHint())
+        if self.requests_thread is not None and self.requests_thread.isRunning():
+            return
+        self.show_placeholder(self.requests_list)
+        self.requests_thread = NetworkThread.shared_request("friends/requests")
+        self.requests_thread.data_received.connect(self.show_friend_requests)
+        self.requests_thread.error_occurred.connect(
+            lambda e: self.show_placeholder(self.requests_list, f"Failed to load friend requests: {e}")
+        )
 
-                    self.requests_list.addItem(item)
-                    self.requests_list.setItemWidget(item, item_widget)
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to load friend requests:\n{e}")
+    def show_friend_requests(self, requests):
+        self.requests_model.set_rows([{
+            "key": r.get('from_user'),
+            "from_user": r.get('from_user'),
+            "text": f"From {r.get('from_user', 'unknown')} ({r.get('requested_at', 'N/A')})",
+            "actions": [("accept", "✔", "lightgreen"), ("reject", "✖", "lightcoral")],
+        } for r in requests or []])
+        self.requests_list.set_placeholder("No pending friend requests.")
+
+    def on_row_action(self, action, row):
+        if action == "chat":
+            self.open_private_chat(row["id"], row["username"])
+        elif action == "accept":
+            self.accept_request(row["from_user"])
+        elif action == "reject":
+            self.reject_request(row["from_user"])
 
     def accept_request(self, requester_id):
         try:
             payload = {
                 "requester_id": requester_id,
-                "addressee_id": self.username + "#" +self.user_tag,
                 "accept": True
             }
             print("ACCEPT PAYLOAD:", payload)  # 👈 لاگ اضافه کن
 
-            response = requests.post(
-                f"{SERVER_URL}/friends/respond",
-                json=payload,
-                timeout=5
-            )
+            response = api_request("friends/respond", payload, "POST")
             if response.status_code == 200:
                 QMessageBox.information(self, "Friend Request", f"Accepted {requester_id}")
                 self.load_friend_requests()
             else:
-                error = response.json().get("error", "Unknown error")
+                error = decode_response(response).get("error", "Unknown error")
                 # print("SERVER ERROR:", error)
                 QMessageBox.warning(self, "Error", f"Could not accept: {error}")
         except Exception as e:
@@ -204,25 +251,37 @@ class FriendsPage(QWidget):
 
     def reject_request(self, requester_id):
         try:
-            response = requests.post(
-                f"{SERVER_URL}/friends/respond",
-                json={
-                    "requester_id": requester_id,
-                    "addressee_id": self.user_id,
-                    "accept": False
-                },
-                timeout=5
-            )
+            response = api_request("friends/respond", {
+                "requester_id": requester_id,
+                "accept": False
+            }, "POST")
             if response.status_code == 200:
                 QMessageBox.information(self, "Friend Request", f"Rejected {requester_id}")
                 self.load_friend_requests()
             else:
-                error = response.json().get("error", "Unknown error")
+                error = decode_response(response).get("error", "Unknown error")
                 QMessageBox.warning(self, "Error", f"Could not reject: {error}")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Network error: {e}")
 
 
+    def run_user_search(self):
+        query = self.add_input.text().strip()
+        if len(query) < 2:
+            return
+        self.search_thread = NetworkThread.NetworkThread("users/search", {"q": query, "limit": 10}, "GET", parent=self)
+        self.search_thread.data_received.connect(partial(self.show_search_results, query))
+        self.search_thread.error_occurred.connect(lambda e: print(f"User search failed: {e}"))
+        self.search_thread.start()
+
+    def show_search_results(self, query, results):
+        # Drop answers for text the user has already moved past
+        if query != self.add_input.text().strip() or not isinstance(results, list):
+            return
+        self.search_model.setStringList([r.get("handle", "") for r in results])
+        self.search_completer.setCompletionPrefix(query)
+        self.search_completer.complete()
+
     def send_friend_request(self):
         friend_id = self.add_input.text().strip()
         if not friend_id:
@@ -242,69 +301,16 @@ class FriendsPage(QWidget):
 
     # ----------- Actual API Calls ------------
 
-    def fetch_online_friends(self):
-        try:
-            response = requests.get(
-                f"{SERVER_URL}/friends/online",
-                params={"user_id": self.user_id},
-                timeout=5
-            )
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            raise RuntimeError(f"Failed to fetch online friends: {e}")
-
-    def fetch_friend_requests(self):
-        try:
-            response = requests.get(
-                f"{SERVER_URL}/friends/requests",
-                params={
-                    "user_id": self.user_id,
-                    "user_tag": self.user_tag,  # اضافه کردن تگ
-                },
-                timeout=5
-            )
-            response.raise_for_status()
-            data = response.json()
-            print(data)
-            return data
-        except Exception as e:
-            raise RuntimeError(f"Failed to fetch friend requests: {e}")
-
-    def fetch_all_friends(self):
-        try:
-            response = requests.get(
-                f"{SERVER_URL}/friends/all",
-                params={
-                    "user_id": self.user_id,
-                    "user_tag": self.user_tag,  # اضافه کردن تگ
-                },
-                timeout=5
-            )
-            response.raise_for_status()
-            data = response.json()
-            print(data)
-            return data
-        except Exception as e:
-            raise RuntimeError(f"Failed to fetch friend requests: {e}")
-
     def api_send_friend_request(self, friend_id):
         try:
-            response = requests.post(
-                f"{SERVER_URL}/friends/request",
-                json={
-                    "from_user_id": self.user_id,
-                    "to_identifier": friend_id
-                },
-                timeout=5
-            )
+            response = api_request("friends/request", {"to_identifier": friend_id}, "POST")
             response.raise_for_status()
-            data = response.json()
+            data = decode_response(response)
             return True, data.get("message", "Friend request sent successfully.")
 
         except requests.exceptions.HTTPError as http_err:
             try:
-                error_msg = response.json().get("message", str(http_err))
+                error_msg = decode_response(response).get("message", str(http_err))
             except Exception:
                 error_msg = str(http_err)
             return False, f"HTTP error occurred: {error_msg}"
@@ -324,6 +330,7 @@ class FriendsPage(QWidget):
             user_id=self.user_id,
             friend_id=friend_id,
             friend_username=friend_username,
+            cache=self.cache,
         )
         self.stack.addWidget(self.private_chat)
         self.stack.setCurrentWidget(self.private_chat)
@@ -334,6 +341,8 @@ class FriendsPage(QWidget):
         self.private_chat.layout().insertWidget(0, back_button)
         
     def back_to_friends(self):
+        self.private_chat.stop()
         self.stack.setCurrentWidget(self.tabs_widget)
         self.stack.removeWidget(self.private_chat)
-        self.private_chat.deleteLater()
\ No newline at end of file
+        self.private_chat.deleteLater()
+        self.private_chat = None
\ No newline at end of file
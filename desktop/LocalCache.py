@@ -0,0 +1,186 @@
+import json
+import os
+import sqlite3
+
+# Per-user cache of what the client has already downloaded, so a new session
+# renders straight from disk and only asks the server for what came after.
+CACHE_DIR = os.environ.get("CHAT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".chat_client"))
+
+# Row caps; the oldest rows beyond these are evicted after each write batch
+MAX_PUBLIC_MESSAGES = 5000
+MAX_PRIVATE_MESSAGES = 20000
+MAX_IDENTITIES = 5000
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY,
+        room_id INTEGER,
+        sender_id INTEGER,
+        sender TEXT,
+        message TEXT,
+        timestamp TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS private_messages (
+        id INTEGER PRIMARY KEY,
+        sender_id INTEGER,
+        receiver_id INTEGER,
+        peer_id INTEGER,
+        sender TEXT,
+        message TEXT,
+        timestamp TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_private_peer ON private_messages(peer_id, id)",
+    """
+    CREATE TABLE IF NOT EXISTS identities (
+        id INTEGER PRIMARY KEY,
+        handle TEXT,
+        seen INTEGER
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT)",
+]
+
+
+class LocalCache:
+    def __init__(self, user_id, path=None):
+        self.user_id = user_id
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, f"cache_{user_id}.db")
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for query in _SCHEMA:
+            self.conn.execute(query)
+        self.conn.commit()
+        self._seen = self._scalar("SELECT MAX(seen) FROM identities") or 0
+
+    def _scalar(self, query, params=()):
+        row = self.conn.execute(query, params).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self.conn.close()
+
+    # ----------------- Public room ------------------
+    def last_message_id(self, room_id=1):
+        return self._scalar("SELECT MAX(id) FROM messages WHERE room_id = ?", (room_id,)) or 0
+
+    def recent_messages(self, room_id=1, limit=200):
+        rows = self.conn.execute(
+            "SELECT * FROM messages WHERE room_id = ? ORDER BY id DESC LIMIT ?", (room_id, limit)
+        ).fetchall()
+        return [dict(r) for r in reversed(rows)]
+
+    def messages_before(self, before_id, limit=50, room_id=1):
+        rows = self.conn.execute(
+            "SELECT * FROM messages WHERE room_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (room_id, before_id, limit)
+        ).fetchall()
+        return [dict(r) for r in reversed(rows)]
+
+    def add_messages(self, messages):
+        rows = [(m.get("id"), m.get("room_id", 1), m.get("sender_id"), m.get("sender"),
+                 m.get("message"), m.get("timestamp")) for m in messages if m.get("id")]
+        if not rows:
+            return
+        self.conn.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self._remember_senders(messages)
+        self._evict("messages", MAX_PUBLIC_MESSAGES)
+        self.conn.commit()
+
+    # ----------------- Private messages ------------------
+    def last_private_id(self):
+        return int(self._get("private_cursor") or 0)
+
+    def set_private_cursor(self, last_id):
+        if last_id > self.last_private_id():
+            self._set("private_cursor", str(last_id))
+            self.conn.commit()
+
+    def conversation_cursor(self, peer_id):
+        """Id up to which this conversation is complete in the cache (0 if never loaded)."""
+        return int(self._get(f"private_cursor:{peer_id}") or 0)
+
+    def set_conversation_cursor(self, peer_id, last_id):
+        if last_id > self.conversation_cursor(peer_id):
+            self._set(f"private_cursor:{peer_id}", str(last_id))
+            self.conn.commit()
+
+    def private_history(self, peer_id, limit=100):
+        rows = self.conn.execute(
+            "SELECT * FROM private_messages WHERE peer_id = ? ORDER BY id DESC LIMIT ?", (peer_id, limit)
+        ).fetchall()
+        return [dict(r) for r in reversed(rows)]
+
+    def private_before(self, peer_id, before_id, limit=50):
+        rows = self.conn.execute(
+            "SELECT * FROM private_messages WHERE peer_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (peer_id, before_id, limit)
+        ).fetchall()
+        return [dict(r) for r in reversed(rows)]
+
+    def has_conversation(self, peer_id):
+        return self._scalar("SELECT 1 FROM private_messages WHERE peer_id = ? LIMIT 1", (peer_id,)) is not None
+
+    def add_private_messages(self, messages, peer_id=None):
+        """Store DMs; peer_id is needed when rows lack receiver_id (the /private/messages shape)."""
+        rows = []
+        for m in messages:
+            if not m.get("id"):
+                continue
+            peer = peer_id
+            if peer is None:
+                peer = m.get("receiver_id") if m.get("sender_id") == self.user_id else m.get("sender_id")
+            rows.append((m["id"], m.get("sender_id"), m.get("receiver_id"), peer,
+                         m.get("sender"), m.get("message"), m.get("timestamp")))
+        if not rows:
+            return
+        self.conn.executemany("INSERT OR REPLACE INTO private_messages VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self._remember_senders(messages)
+        self._evict("private_messages", MAX_PRIVATE_MESSAGES)
+        self.conn.commit()
+
+    # ----------------- Friends and identities ------------------
+    def friends(self):
+        data = self._get("friends")
+        return json.loads(data) if data else None
+
+    def save_friends(self, friends):
+        self._set("friends", json.dumps(friends))
+        self.conn.commit()
+
+    def identity(self, user_id):
+        return self._scalar("SELECT handle FROM identities WHERE id = ?", (user_id,))
+
+    def _remember_senders(self, messages):
+        rows = []
+        for m in messages:
+            if m.get("sender_id") and m.get("sender"):
+                self._seen += 1
+                rows.append((m["sender_id"], m["sender"], self._seen))
+        if rows:
+            self.conn.executemany("INSERT OR REPLACE INTO identities VALUES (?, ?, ?)", rows)
+            self.conn.execute(
+                "DELETE FROM identities WHERE seen <= ?", (self._seen - MAX_IDENTITIES,)
+            )
+
+    # ----------------- Internals ------------------
+    def _evict(self, table, cap):
+        # Drop the oldest rows above the cap (an id range delete on the primary key)
+        self.conn.execute(
+            f"DELETE FROM {table} WHERE id <= (SELECT id FROM {table} ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (cap,)
+        )
+
+    def _get(self, key):
+        return self._scalar("SELECT value FROM kv WHERE key = ?", (key,))
+
+    def _set(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, value))
@@ -1,17 +1,10 @@
-import sys
-import requests
-from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
-                             QHBoxLayout, QLabel, QLineEdit, QPushButton,
-                             QTextEdit, QStackedWidget, QListWidget,
-                             QMessageBox, QStatusBar, QSpacerItem, QSizePolicy)
-from PyQt6.QtCore import QTimer, Qt, QThread, pyqtSignal, QObject
-from PyQt6.QtGui import QFont, QTextCursor, QColor
+from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel,
+                             QLineEdit, QPushButton, QMessageBox)
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QFont
 
 import NetworkThread
 
-# Required for timestamp parsing
-from datetime import datetime
-
 # --- Configuration ---
 SERVER_URL = "http://localhost:5000/api" # Base API URL
 
@@ -46,7 +39,7 @@ class LoginWindow(QWidget):
         username_label = QLabel("Username:")
         username_label.setFont(QFont("Arial", 12))
         self.username_input = QLineEdit()
-        self.username_input.setPlaceholderText("Enter your username")
+        self.username_input.setPlaceholderText("Enter your username (or username#tag)")
         self.username_input.setFont(QFont("Arial", 12))
         self.username_input.setMinimumHeight(35) # Make input fields taller
         self.username_input.setStyleSheet("padding: 5px; border: 1px solid #ccc; border-radius: 5px;")
@@ -126,8 +119,9 @@ class LoginWindow(QWidget):
             return
 
         self.parent_app.user_id = data.get("user_id")
-        self.parent_app.username = self.username_input.text().strip()
+        self.parent_app.username = self.username_input.text().strip().split('#')[0]
         self.parent_app.tag = data.get("user_tag")  # اضافه شده برای رفع ارور
+        NetworkThread.set_auth_token(data.get("token"))
         self.parent_app.status_bar.showMessage(f"Login successful for {self.parent_app.username}.", 3000) # Message for 3 seconds
         self.parent_app.switch_page("chat")
         self.set_ui_enabled(True)
@@ -0,0 +1,183 @@
+from PyQt6.QtWidgets import QListView, QStyledItemDelegate, QAbstractItemView
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QSize, pyqtSignal
+from PyQt6.QtGui import QColor, QFont, QFontMetrics, QPen
+
+# Rows kept in memory; appending drops the oldest, and scrolling back stops here
+MAX_SCROLLBACK = 2000
+MessageRole = Qt.ItemDataRole.UserRole + 1
+
+PADDING = 8
+LINE_GAP = 2
+
+
+class MessageModel(QAbstractListModel):
+    """
+    Chat rows as plain dicts: {"id", "sender", "text", "time", "mine"}, oldest first.
+    Rows not yet confirmed by the server (optimistic sends) use negative ids.
+    """
+
+    def __init__(self, max_rows=MAX_SCROLLBACK, parent=None):
+        super().__init__(parent)
+        self.max_rows = max_rows
+        self._rows = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self._rows[index.row()]
+        if role == MessageRole:
+            return row
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"{row['sender']}: {row['text']}"
+        return None
+
+    def newest_id(self):
+        return next((r["id"] for r in reversed(self._rows) if r["id"] > 0), 0)
+
+    def oldest_id(self):
+        return next((r["id"] for r in self._rows if r["id"] > 0), 0)
+
+    def row_of(self, message_id):
+        for i in range(len(self._rows) - 1, -1, -1):
+            if self._rows[i]["id"] == message_id:
+                return i
+        return -1
+
+    def replace_row(self, message_id, row):
+        """Swap a row in place, e.g. an optimistic send once the server assigned its id."""
+        i = self.row_of(message_id)
+        if i < 0:
+            return False
+        self._rows[i] = row
+        index = self.index(i)
+        self.dataChanged.emit(index, index)
+        return True
+
+    def remove_row(self, message_id):
+        i = self.row_of(message_id)
+        if i >= 0:
+            self.beginRemoveRows(QModelIndex(), i, i)
+            del self._rows[i]
+            self.endRemoveRows()
+
+    def is_full(self):
+        return len(self._rows) >= self.max_rows
+
+    def append_rows(self, rows):
+        if not rows:
+            return
+        rows = rows[-self.max_rows:]
+        overflow = len(self._rows) + len(rows) - self.max_rows
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            del self._rows[:overflow]
+            self.endRemoveRows()
+        start = len(self._rows)
+        self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+        self._rows.extend(rows)
+        self.endInsertRows()
+
+    def prepend_rows(self, rows):
+        """Insert older rows at the top, only as many as the scrollback cap leaves room for."""
+        room = self.max_rows - len(self._rows)
+        rows = rows[-room:] if room > 0 else []
+        if rows:
+            self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+            self._rows[:0] = rows
+            self.endInsertRows()
+        return len(rows)
+
+    def clear(self):
+        self.beginResetModel()
+        self._rows = []
+        self.endResetModel()
+
+
+class MessageDelegate(QStyledItemDelegate):
+    """
+    Paints one message: sender line, wrapped text and timestamp, right-aligned for
+    our own messages. Row heights are cached per (message id, width), so
+    scrolling only measures rows that are new or were resized.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.body_font = QFont("Consolas", 11)
+        self.sender_font = QFont("Consolas", 11, QFont.Weight.Bold)
+        self.time_font = QFont("Arial", 8)
+        self._heights = {}
+        self._cached_width = None
+
+    def _layout(self, row, width):
+        """(sender line, wrapped body, timestamp) heights for a row at this width."""
+        text_width = max(width - 2 * PADDING, 50)
+        body = QFontMetrics(self.body_font).boundingRect(
+            QRect(0, 0, text_width, 100000), Qt.TextFlag.TextWordWrap, row["text"]
+        )
+        return QFontMetrics(self.sender_font).height(), body.height(), QFontMetrics(self.time_font).height()
+
+    def sizeHint(self, option, index):
+        width = option.rect.width() or (self.parent().viewport().width() if self.parent() else 400)
+        if width != self._cached_width:
+            self._heights.clear()
+            self._cached_width = width
+        row = index.data(MessageRole)
+        height = self._heights.get(row["id"])
+        if height is None:
+            height = sum(self._layout(row, width)) + 2 * LINE_GAP + 2 * PADDING
+            self._heights[row["id"]] = height
+            if len(self._heights) > 4 * MAX_SCROLLBACK:
+                self._heights.clear()
+        return QSize(width, height)
+
+    def paint(self, painter, option, index):
+        row = index.data(MessageRole)
+        painter.save()
+        rect = option.rect.adjusted(PADDING, PADDING, -PADDING, -PADDING)
+        align = Qt.AlignmentFlag.AlignRight if row["mine"] else Qt.AlignmentFlag.AlignLeft
+        sender_height, body_height, time_height = self._layout(row, option.rect.width())
+
+        top = rect.top()
+        painter.setFont(self.sender_font)
+        painter.setPen(QColor("#4CAF50" if row["mine"] else "#2196F3"))
+        painter.drawText(QRect(rect.left(), top, rect.width(), sender_height), align,
+                         "You:" if row["mine"] else f"{row['sender']}:")
+        top += sender_height + LINE_GAP
+
+        painter.setFont(self.body_font)
+        painter.setPen(QColor("#ddd"))
+        painter.drawText(QRect(rect.left(), top, rect.width(), body_height),
+                         align | Qt.TextFlag.TextWordWrap, row["text"])
+        top += body_height + LINE_GAP
+
+        painter.setFont(self.time_font)
+        painter.setPen(QColor("#888"))
+        painter.drawText(QRect(rect.left(), top, rect.width(), time_height), align, row["time"])
+
+        painter.setPen(QPen(QColor("#444"), 1))
+        painter.drawLine(option.rect.left(), option.rect.bottom(), option.rect.right(), option.rect.bottom())
+        painter.restore()
+
+
+class MessageListView(QListView):
+    """List view that asks for the previous page when scrolled to the top."""
+    older_requested = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.setWordWrap(True)
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.verticalScrollBar().valueChanged.connect(self._on_scroll)
+
+    def is_at_bottom(self):
+        bar = self.verticalScrollBar()
+        return bar.value() >= bar.maximum() - 30
+
+    def _on_scroll(self, value):
+        if value == self.verticalScrollBar().minimum() and self.model() and self.model().rowCount() > 0:
+            self.older_requested.emit()
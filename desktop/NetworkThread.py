@@ -1,59 +1,223 @@
-import sys
-import requests
-from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
-                             QHBoxLayout, QLabel, QLineEdit, QPushButton,
-                             QTextEdit, QStackedWidget, QListWidget,
-                             QMessageBox, QStatusBar, QSpacerItem, QSizePolicy)
-from PyQt6.QtCore import QTimer, Qt, QThread, pyqtSignal, QObject
-from PyQt6.QtGui import QFont, QTextCursor, QColor
+import os
+import threading
+from PyQt6.QtCore import pyqtSignal, QObject, QRunnable, QThreadPool
 
 SERVER_URL = "http://localhost:5000/api" # Base API URL
 
-# --- Network Thread for Async Operations ---
-class NetworkThread(QThread):
+# One keep-alive session and a fixed set of worker threads shared by every window,
+# so the polling timers reuse TCP connections instead of opening one per request.
+POOL_SIZE = 4
+REQUEST_TIMEOUT = 5
+
+# requests is only imported when the first request goes out (usually on a pool
+# worker), so it stays off the path to the login window's first paint
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+_pool = QThreadPool()
+_pool.setMaxThreadCount(POOL_SIZE)
+
+# Session token issued by /api/login; sent as a Bearer header on every request
+AUTH_TOKEN = None
+
+def set_auth_token(token):
+    global AUTH_TOKEN
+    AUTH_TOKEN = token
+
+def auth_headers():
+    return {"Authorization": f"Bearer {AUTH_TOKEN}"} if AUTH_TOKEN else {}
+
+# Optional MessagePack wire format (smaller payloads, cheaper decode on the polling paths)
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPE = "application/msgpack"
+USE_MSGPACK = msgpack is not None and os.environ.get("CHAT_USE_MSGPACK", "1") != "0"
+# Request bodies switch to MessagePack only once the server has answered in it,
+# so a server without msgpack keeps getting JSON it can read
+_server_msgpack = False
+
+def request_headers():
+    headers = auth_headers()
+    if USE_MSGPACK:
+        headers["Accept"] = f"{MSGPACK_MIMETYPE}, application/json;q=0.5"
+    return headers
+
+def encode_body(data):
+    """Return (body bytes, content type) for a request payload."""
+    if USE_MSGPACK and _server_msgpack:
+        return msgpack.packb(data, use_bin_type=True), MSGPACK_MIMETYPE
+    return None, None
+
+def decode_response(response):
+    global _server_msgpack
+    content_type = response.headers.get("Content-Type", "")
+    if msgpack is not None and content_type.startswith(MSGPACK_MIMETYPE):
+        _server_msgpack = True
+        return msgpack.unpackb(response.content, raw=False)
+    return response.json()
+
+def api_request(endpoint, data=None, method="GET", timeout=REQUEST_TIMEOUT):
+    """
+    Blocking call through the shared session. GET sends data as query parameters,
+    POST as the request body. Returns the requests.Response (decode with decode_response).
+    """
+    full_url = f"{SERVER_URL.rstrip('/')}/{endpoint.lstrip('/')}"
+    session = get_session()
+    headers = request_headers()
+    if method == "POST":
+        body, content_type = encode_body(data)
+        if body is not None:
+            headers["Content-Type"] = content_type
+            return session.post(full_url, data=body, headers=headers, timeout=timeout)
+        return session.post(full_url, json=data, headers=headers, timeout=timeout)
+    return session.get(full_url, params=data, headers=headers, timeout=timeout)
+
+def shutdown(timeout_ms=2000):
+    """Wait briefly for in-flight requests, then close pooled connections."""
+    _pool.waitForDone(timeout_ms)
+    if _session is not None:
+        _session.close()
+
+# Tasks stay referenced until their result has been delivered on the GUI thread
+_active = set()
+# (method, endpoint, params) -> task, so identical GETs in flight share one request
+_inflight = {}
+
+def _request_key(endpoint, data, method):
+    params = tuple(sorted(data.items())) if isinstance(data, dict) else data
+    return (method, endpoint.lstrip("/"), params)
+
+def shared_request(endpoint, data=None, method="GET"):
+    """
+    Start a request, or join the identical GET that is already in flight.
+    Connect to the returned task's signals right away; results are delivered
+    on the GUI thread, so a caller that joins late still gets them.
+    """
+    key = _request_key(endpoint, data, method) if method == "GET" else None
+    task = _inflight.get(key) if key else None
+    if task is None:
+        task = NetworkThread(endpoint, data, method)
+        if key:
+            task._key = key
+            _inflight[key] = task
+        task.start()
+    return task
+
+class _Runner(QRunnable):
+    def __init__(self, task):
+        super().__init__()
+        self.task = task
+
+    def run(self):
+        self.task._run()
+
+# --- Async request on the shared worker pool ---
+class NetworkThread(QObject):
     """
-    A QThread subclass to perform network requests in a non-blocking way.
-    Emits data_received on success (can be dict or list) or error_occurred on failure.
+    A network request executed on the shared worker pool (the name is kept from
+    when each request had its own QThread). Emits data_received on success (can be
+    dict or list) or error_occurred on failure, then finished.
     """
-    # *** THIS IS THE CRUCIAL CHANGE: Accept any Python object ***
     data_received = pyqtSignal(object)
     error_occurred = pyqtSignal(str)
+    finished = pyqtSignal()
+    # worker -> GUI thread: (result, error message)
+    _completed = pyqtSignal(object, object)
 
     def __init__(self, endpoint, data=None, method="GET", parent=None):
-        super().__init__(parent)
+        # parent is accepted for compatibility; the pool owns the task while it runs
+        super().__init__()
         self.endpoint = endpoint
         self.data = data
         self.method = method
+        self._key = None
+        # Server pacing hints from the last response (seconds / milliseconds)
+        self.retry_after = None
+        self.poll_interval = None
+        self._running = False
+        self._cancelled = False
+        self._completed.connect(self._deliver)
 
-    def run(self):
-        full_url = f"{SERVER_URL.rstrip('/')}/{self.endpoint.lstrip('/')}"
+    def start(self):
+        self._running = True
+        _active.add(self)
+        _pool.start(_Runner(self))
+
+    def isRunning(self):
+        return self._running
+
+    def cancel(self):
+        """Drop the result; the request itself is left to finish on its worker."""
+        self._cancelled = True
+        self._forget()
+
+    def _forget(self):
+        if self._key and _inflight.get(self._key) is self:
+            del _inflight[self._key]
+
+    def _deliver(self, result, error):
+        # Runs on the GUI thread, so signal handlers and cursor updates never race
+        self._running = False
+        self._forget()
+        _active.discard(self)
+        if not self._cancelled:
+            if error is None:
+                self.data_received.emit(result)
+            else:
+                self.error_occurred.emit(error)
+        self.finished.emit()
+
+    def _read_hints(self, response):
         try:
-            if self.method == "POST":
-                response = requests.post(full_url, json=self.data, timeout=5)
-            else: # Default to GET
-                # For GET requests, if 'data' is passed, treat it as query parameters
-                params = self.data if self.method == "GET" else None
-                response = requests.get(full_url, params=params, timeout=5)
+            self.retry_after = float(response.headers.get("Retry-After", "")) or None
+        except ValueError:
+            self.retry_after = None
+        try:
+            self.poll_interval = int(response.headers.get("X-Poll-Interval", "")) or None
+        except ValueError:
+            self.poll_interval = None
 
+    def _run(self):
+        import requests
+        result, error = None, None
+        try:
+            response = api_request(self.endpoint, self.data, self.method)
+            self._read_hints(response)
             response.raise_for_status() # Raises an HTTPError for bad responses (4xx or 5xx)
 
-            # Emit the JSON response as an object (can be dict or list)
-            self.data_received.emit(response.json())
+            # Decoded response as an object (can be dict or list)
+            result = decode_response(response)
 
         except requests.exceptions.HTTPError as e:
             # Try to get specific error message from server response
             try:
-                error_msg = e.response.json().get('message', f'HTTP Error: {e.response.status_code}')
-            except (ValueError, requests.exceptions.JSONDecodeError): # Handle cases where response is not valid JSON
+                error_msg = decode_response(e.response).get('message', f'HTTP Error: {e.response.status_code}')
+            except Exception: # Handle cases where response is not valid JSON/MessagePack
                 error_msg = f'HTTP Error {e.response.status_code}: {e.response.text}'
-            self.error_occurred.emit(f"Server error: {error_msg}")
+            error = f"Server error: {error_msg}"
         except requests.exceptions.ConnectionError:
-            self.error_occurred.emit("Network error: Could not connect to server. Is it running?")
+            error = "Network error: Could not connect to server. Is it running?"
         except requests.exceptions.Timeout:
-            self.error_occurred.emit("Network error: Server response timed out.")
+            error = "Network error: Server response timed out."
         except requests.exceptions.RequestException as e:
-            self.error_occurred.emit(f"An unexpected network error occurred: {str(e)}")
+            error = f"An unexpected network error occurred: {str(e)}"
         except Exception as e:
-            self.error_occurred.emit(f"An unexpected error occurred: {str(e)}")
-        self.quit()
-    
+            error = f"An unexpected error occurred: {str(e)}"
+        self._completed.emit(result, error)
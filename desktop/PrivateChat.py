@@ -1,14 +1,24 @@
+from datetime import datetime, timezone
+from functools import partial
+
 from PyQt6.QtWidgets import (
-    QWidget, QVBoxLayout, QTextEdit, QLineEdit, QPushButton, QLabel, QMessageBox
+    QWidget, QVBoxLayout, QLineEdit, QPushButton, QLabel, QMessageBox, QListView
 )
 from PyQt6.QtCore import Qt
-import requests
 
-SERVER_URL = "http://localhost:5000/api"
+import NetworkThread
+from AdaptivePoller import AdaptivePoller
+from MessageList import MessageModel, MessageDelegate, MessageListView
+from TimeFormat import format_timestamps
+
+PAGE_SIZE = 50
+# New DMs are picked up from /private/inbox: (fastest, slowest when idle) in ms
+INBOX_POLL_MS = (1500, 15000)
 
 class PrivateChatWidget(QWidget):
-    def __init__(self, user_id, friend_id, friend_username, parent=None):
+    def __init__(self, user_id, friend_id, friend_username, parent=None, cache=None):
         super().__init__(parent)
+        self.cache = cache
 
         self.user_id = user_id
         self.friend_id = friend_id
@@ -17,14 +27,30 @@ class PrivateChatWidget(QWidget):
         self.username = getattr(parent, "username", "Unknown")
         self.tag = getattr(parent, "tag", "0000")
 
+        self.history_thread = None
+        self.older_thread = None
+        self.inbox_thread = None
+        # Last /private/inbox id applied; None until the initial history is on screen
+        self.inbox_cursor = None
+        self.inbox_activity = False
+        self.history_exhausted = False
+        self.known_ids = set()
+        # Optimistic sends waiting for their server id: temp id (negative) -> text
+        self.pending = {}
+        self.next_temp_id = -1
+        self.send_tasks = set()
+
         layout = QVBoxLayout(self)
 
         self.label = QLabel(f"Private chat with {friend_username}")
         self.label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         layout.addWidget(self.label)
 
-        self.chat_display = QTextEdit()
-        self.chat_display.setReadOnly(True)
+        self.model = MessageModel(parent=self)
+        self.chat_display = MessageListView()
+        self.chat_display.setModel(self.model)
+        self.chat_display.setItemDelegate(MessageDelegate(self.chat_display))
+        self.chat_display.older_requested.connect(self.load_older_messages)
         layout.addWidget(self.chat_display)
 
         self.input = QLineEdit()
@@ -34,52 +60,200 @@ class PrivateChatWidget(QWidget):
         layout.addWidget(self.send_btn)
 
         self.send_btn.clicked.connect(self.send_message)
+        self.input.returnPressed.connect(self.send_message)
 
+        self.poller = AdaptivePoller(self.poll_inbox, *INBOX_POLL_MS, parent=self)
         self.load_chat_history()
 
+    def stop(self):
+        self.poller.stop()
+        for task in (self.history_thread, self.older_thread, self.inbox_thread, *self.send_tasks):
+            if task is not None and task.isRunning():
+                task.cancel()
+
+    # ----------------- Rendering ------------------
+    def to_rows(self, messages):
+        times = format_timestamps([msg.get('timestamp', '') for msg in messages])
+        return [{
+            "id": msg['id'],
+            "sender": self.friend_username,
+            "text": msg.get('message', ''),
+            "time": time,
+            "mine": msg.get('sender_id') == self.user_id,
+        } for msg, time in zip(messages, times)]
+
+    def show_messages(self, messages):
+        """Append new messages, swapping in any that confirm one of our optimistic sends."""
+        fresh = []
+        for msg in sorted(messages, key=lambda m: m['id']):
+            if msg['id'] in self.known_ids:
+                continue
+            self.known_ids.add(msg['id'])
+            if msg.get('sender_id') == self.user_id:
+                temp_id = next((t for t, text in self.pending.items() if text == msg.get('message')), None)
+                if temp_id is not None:
+                    del self.pending[temp_id]
+                    self.model.replace_row(temp_id, self.to_rows([msg])[0])
+                    continue
+            fresh.append(msg)
+        if not fresh:
+            return
+        at_bottom = self.chat_display.is_at_bottom()
+        self.model.append_rows(self.to_rows(fresh))
+        if at_bottom:
+            self.chat_display.scrollToBottom()
+
+    # ----------------- Initial load ------------------
     def load_chat_history(self):
-        try:
-            params = {
-                "user1_id": self.user_id,
-                "user2_id": self.friend_id,
-                "limit": 100  # می‌تونی اینو تنظیم کنی
-            }
-            response = requests.get(f"{SERVER_URL}/private/messages", params=params, timeout=5)
-            response.raise_for_status()
-            history = response.json()
-            print(history)
-
-            self.chat_display.clear()
-            for msg in history:
-                sender = "You" if msg['sender'] == self.username + "#" + self.tag else self.friend_username
-                self.chat_display.append(f"{sender}: {msg['message']}")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to load chat history:\n{e}")
+        cursor = self.cache.conversation_cursor(self.friend_id) if self.cache else 0
+        if cursor and self.cache.has_conversation(self.friend_id):
+            # Cached conversation shows instantly; the first poll pulls what came after it
+            self.show_messages(self.cache.private_history(self.friend_id, PAGE_SIZE))
+            self.inbox_cursor = max(cursor, self.cache.last_private_id())
+            self.poller.start()
+            return
+
+        self.history_thread = NetworkThread.shared_request(
+            "private/messages", {"user2_id": self.friend_id, "limit": PAGE_SIZE}
+        )
+        self.history_thread.data_received.connect(self.history_loaded)
+        self.history_thread.error_occurred.connect(
+            lambda e: QMessageBox.critical(self, "Error", f"Failed to load chat history:\n{e}")
+        )
+
+    def history_loaded(self, history):
+        if not isinstance(history, list):
+            return
+        # The latest page is complete up to its newest id, so polling resumes from there
+        newest = max((m['id'] for m in history), default=0)
+        if self.cache:
+            self.cache.add_private_messages(history, peer_id=self.friend_id)
+            self.cache.set_conversation_cursor(self.friend_id, newest)
+        self.show_messages(history)
+        self.inbox_cursor = max(newest, self.cache.last_private_id()) if self.cache else newest
+        self.poller.start()
+
+    # ----------------- Incremental refresh ------------------
+    def poll_inbox(self):
+        if self.inbox_cursor is None or (self.inbox_thread is not None and self.inbox_thread.isRunning()):
+            return False
+        since_id = self.inbox_cursor
+        self.inbox_activity = False
+        self.inbox_thread = NetworkThread.shared_request("private/inbox", {"since_id": since_id, "limit": 200})
+        self.inbox_thread.data_received.connect(partial(self.inbox_received, since_id))
+        self.inbox_thread.error_occurred.connect(lambda e: print(f"Error polling private inbox: {e}"))
+        self.inbox_thread.finished.connect(
+            lambda task=self.inbox_thread: self.poller.done(
+                activity=self.inbox_activity,
+                hint_ms=task.poll_interval,
+                retry_after=task.retry_after
+            )
+        )
+        return True
+
+    def inbox_received(self, since_id, page):
+        if not isinstance(page, dict):
+            return
+        messages = page.get("messages", [])
+        last_id = page.get("last_id", since_id)
+        if self.cache:
+            # The inbox covers every conversation; keep them all, and only move a
+            # cursor (global or this conversation's) if the page continues right where it left off
+            self.cache.add_private_messages(messages)
+            if since_id <= self.cache.last_private_id():
+                self.cache.set_private_cursor(last_id)
+            if since_id <= self.cache.conversation_cursor(self.friend_id):
+                self.cache.set_conversation_cursor(self.friend_id, last_id)
+        self.inbox_cursor = max(self.inbox_cursor or 0, last_id)
 
+        conversation = {self.user_id, self.friend_id}
+        ours = [m for m in messages if {m.get('sender_id'), m.get('receiver_id')} == conversation]
+        if ours:
+            self.inbox_activity = True
+            self.show_messages(ours)
+        if page.get("has_more"):
+            self.poller.poke()
+
+    # ----------------- Older history ------------------
+    def load_older_messages(self):
+        if self.older_thread is not None and self.older_thread.isRunning():
+            return
+        before_id = self.model.oldest_id()
+        if not before_id or self.history_exhausted or self.model.is_full():
+            return
+        cached = self.cache.private_before(self.friend_id, before_id, PAGE_SIZE) if self.cache else []
+        if cached:
+            self.prepend_older_messages(cached)
+            return
+        self.older_thread = NetworkThread.shared_request(
+            "private/messages", {"user2_id": self.friend_id, "limit": PAGE_SIZE, "before_id": before_id}
+        )
+        self.older_thread.data_received.connect(self.older_messages_received)
+        self.older_thread.error_occurred.connect(lambda e: print(f"Error loading older messages: {e}"))
+
+    def older_messages_received(self, history):
+        if not isinstance(history, list):
+            return
+        if not history:
+            self.history_exhausted = True
+            return
+        if self.cache:
+            self.cache.add_private_messages(history, peer_id=self.friend_id)
+        self.prepend_older_messages(history)
+
+    def prepend_older_messages(self, messages):
+        oldest = self.model.oldest_id()
+        older = [m for m in sorted(messages, key=lambda m: m['id'])
+                 if m['id'] < oldest and m['id'] not in self.known_ids]
+        added = self.model.prepend_rows(self.to_rows(older))
+        self.known_ids.update(m['id'] for m in older[len(older) - added:])
+        if added:
+            self.chat_display.scrollTo(self.model.index(added), QListView.ScrollHint.PositionAtTop)
+
+    # ----------------- Sending ------------------
     def send_message(self):
         message = self.input.text().strip()
         if not message:
             return
 
-        try:
-            payload = {
-                "sender_id": self.user_id,
-                "receiver_id": self.friend_id,
-                "message": message
-            }
-            response = requests.post(f"{SERVER_URL}/private/send", json=payload, timeout=5)
-            response.raise_for_status()
-
-            # اگر سرور تایید کرد، پیام را در چت نمایش بده
-            self.chat_display.append(f"You: {message}")
-            self.input.clear()
-
-        except requests.exceptions.HTTPError as http_err:
-            try:
-                err_msg = response.json().get("error", str(http_err))
-            except Exception:
-                err_msg = str(http_err)
-            QMessageBox.warning(self, "Send Failed", f"HTTP error: {err_msg}")
-
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to send message:\n{e}")
+        # Show it right away; the server's id replaces the temporary one when it answers
+        temp_id = self.next_temp_id
+        self.next_temp_id -= 1
+        self.pending[temp_id] = message
+        self.model.append_rows([{
+            "id": temp_id, "sender": self.friend_username, "text": message, "time": "sending…", "mine": True
+        }])
+        self.chat_display.scrollToBottom()
+        self.input.clear()
+
+        task = NetworkThread.NetworkThread("private/send", {"receiver_id": self.friend_id, "message": message}, "POST")
+        task.data_received.connect(partial(self.send_confirmed, temp_id))
+        task.error_occurred.connect(partial(self.send_failed, temp_id))
+        task.finished.connect(partial(self.send_tasks.discard, task))
+        self.send_tasks.add(task)
+        task.start()
+
+    def send_confirmed(self, temp_id, data):
+        message = self.pending.pop(temp_id, None)
+        message_id = data.get("message_id") if isinstance(data, dict) else None
+        if message is None or message_id is None:
+            return  # already reconciled by a poll that saw the stored message
+        if message_id in self.known_ids:
+            self.model.remove_row(temp_id)
+        else:
+            self.known_ids.add(message_id)
+            now = datetime.now(timezone.utc).isoformat()
+            self.model.replace_row(temp_id, {
+                "id": message_id, "sender": self.friend_username, "text": message,
+                "time": format_timestamps([now])[0], "mine": True
+            })
+        self.poller.poke()
+
+    def send_failed(self, temp_id, error):
+        message = self.pending.pop(temp_id, None)
+        if message is None:
+            return
+        self.model.replace_row(temp_id, {
+            "id": temp_id, "sender": self.friend_username, "text": message, "time": "not sent", "mine": True
+        })
+        QMessageBox.warning(self, "Send Failed", error)
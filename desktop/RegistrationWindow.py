@@ -1,17 +1,9 @@
-import sys
-import requests
-from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
-                             QHBoxLayout, QLabel, QLineEdit, QPushButton,
-                             QTextEdit, QStackedWidget, QListWidget,
-                             QMessageBox, QStatusBar, QSpacerItem, QSizePolicy)
-from PyQt6.QtCore import QTimer, Qt, QThread, pyqtSignal, QObject
-from PyQt6.QtGui import QFont, QTextCursor, QColor
+from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel,
+                             QLineEdit, QPushButton, QMessageBox)
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QFont
 
 import NetworkThread
-import LoginWindow
-
-# Required for timestamp parsing
-from datetime import datetime
 
 # --- Configuration ---
 SERVER_URL = "http://localhost:5000/api" # Base API URL
@@ -0,0 +1,58 @@
+import json
+import os
+import time
+
+# Cold-start milestones, measured from when this module is imported. client_desktop
+# imports it before anything else, so "imports" covers Qt and the client modules.
+#   imports      every module needed for the login window is loaded
+#   first_paint  the main window received its first paint event
+#   interactive  the event loop went idle after that paint (input is handled from here on)
+# Set CHAT_STARTUP_LOG to a file path to append each run as a JSON line for tracking.
+STARTUP_LOG = os.environ.get("CHAT_STARTUP_LOG")
+
+_start = time.perf_counter()
+_marks = {}
+_watcher = None
+
+
+def mark(name):
+    """Record a milestone once; later calls with the same name are ignored."""
+    if name not in _marks:
+        _marks[name] = time.perf_counter() - _start
+
+
+def report():
+    parts = [f"{name.replace('_', ' ')} {seconds * 1000:.0f} ms" for name, seconds in _marks.items()]
+    print("Startup: " + " | ".join(parts))
+    if STARTUP_LOG:
+        try:
+            with open(STARTUP_LOG, "a", encoding="utf-8") as log:
+                entry = {name: round(seconds * 1000, 1) for name, seconds in _marks.items()}
+                entry["time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+                log.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"Could not write startup log: {e}")
+
+
+def watch(window):
+    """Mark first_paint and interactive for window, then print the report."""
+    global _watcher
+    from PyQt6.QtCore import QObject, QEvent, QTimer
+
+    class _FirstPaint(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Type.Paint:
+                mark("first_paint")
+                obj.removeEventFilter(self)
+                # A zero timer fires once the events queued behind the first paint are done
+                QTimer.singleShot(0, _interactive)
+            return False
+
+    def _interactive():
+        global _watcher
+        mark("interactive")
+        _watcher = None
+        report()
+
+    _watcher = _FirstPaint()
+    window.installEventFilter(_watcher)
@@ -0,0 +1,61 @@
+import re
+from datetime import datetime
+from functools import lru_cache
+
+DISPLAY_FORMAT = '%Y/%m/%d %H:%M'
+
+# "YYYY-MM-DD HH:MM" (or with a T) plus an optional UTC offset / Z at the end.
+# The output has minute resolution and offsets are whole minutes, so the
+# seconds never change the result and can be dropped from the memo key.
+_MINUTE_PREFIX = re.compile(r"^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}")
+_OFFSET_SUFFIX = re.compile(r"(Z|[+-]\d{2}:?\d{2})$")
+
+
+@lru_cache(maxsize=1)
+def _tehran():
+    # pytz and jdatetime are imported on the first conversion, not at client startup
+    import pytz
+    return pytz.timezone('Asia/Tehran')
+
+
+def _convert(iso_string):
+    import jdatetime
+    utc_dt = datetime.fromisoformat(iso_string.replace('Z', '+00:00'))
+    tehran_dt = utc_dt.astimezone(_tehran())
+    return jdatetime.datetime.fromgregorian(datetime=tehran_dt).strftime(DISPLAY_FORMAT)
+
+
+@lru_cache(maxsize=4096)
+def _format_minute(minute_key):
+    return _convert(minute_key)
+
+
+def _minute_key(iso_string):
+    prefix = _MINUTE_PREFIX.match(iso_string)
+    if prefix is None:
+        return None
+    offset = _OFFSET_SUFFIX.search(iso_string, prefix.end())
+    return prefix.group(0) + (offset.group(0) if offset else "")
+
+
+def format_timestamp(iso_string):
+    """Server timestamp -> 'YYYY/MM/DD HH:MM' in the Persian calendar, Tehran time."""
+    if not iso_string:
+        return ""
+    try:
+        key = _minute_key(iso_string)
+        return _format_minute(key) if key else _convert(iso_string)
+    except ValueError:
+        return iso_string
+
+
+def format_timestamps(iso_strings):
+    """Format a whole backfill at once; each distinct minute is converted only once."""
+    seen = {}
+    result = []
+    for iso_string in iso_strings:
+        text = seen.get(iso_string)
+        if text is None:
+            text = seen[iso_string] = format_timestamp(iso_string)
+        result.append(text)
+    return result
@@ -0,0 +1,59 @@
+"""
+Timestamp formatting cost for a chat backfill.
+
+Compares the old per-message conversion (timezone lookup, parse, jdatetime,
+strftime every time) with TimeFormat's memoized single and batch paths.
+
+    python bench_timestamps.py --messages 10000 --spacing 5
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import jdatetime
+import pytz
+
+import TimeFormat
+
+
+def to_tehran_time_persian(utc_iso_string):
+    # The original ChatWindow implementation, kept here as the baseline
+    utc_dt = datetime.fromisoformat(utc_iso_string.replace('Z', '+00:00'))
+    tehran = pytz.timezone('Asia/Tehran')
+    tehran_dt = utc_dt.astimezone(tehran)
+    jdate = jdatetime.datetime.fromgregorian(datetime=tehran_dt)
+    return jdate.strftime('%Y/%m/%d %H:%M')
+
+
+def measure(label, func, count):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:>20}: {elapsed * 1e3:8.1f} ms total  {elapsed / count * 1e6:7.2f} us/message")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--spacing", type=float, default=5.0, help="seconds between messages")
+    args = parser.parse_args()
+
+    start = datetime(2025, 3, 20, 12, 0, 0)
+    stamps = [(start + timedelta(seconds=i * args.spacing)).strftime('%Y-%m-%d %H:%M:%S')
+              for i in range(args.messages)]
+    minutes = len({s[:16] for s in stamps})
+    print(f"messages={args.messages} distinct minutes={minutes}")
+
+    baseline = measure("per message", lambda: [to_tehran_time_persian(s) for s in stamps], args.messages)
+    TimeFormat._format_minute.cache_clear()
+    memoized = measure("memoized (cold)", lambda: [TimeFormat.format_timestamp(s) for s in stamps], args.messages)
+    measure("memoized (warm)", lambda: [TimeFormat.format_timestamp(s) for s in stamps], args.messages)
+    TimeFormat._format_minute.cache_clear()
+    batch = measure("batch (cold)", lambda: TimeFormat.format_timestamps(stamps), args.messages)
+
+    assert baseline == memoized == batch, "formatted output differs from the baseline"
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,11 @@
+import StartupTimer  # first, so the startup clock includes every import below
+
 import sys
-import requests
-from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
-                             QHBoxLayout, QLabel, QLineEdit, QPushButton,
-                             QTextEdit, QStackedWidget, QListWidget,
-                             QMessageBox, QStatusBar, QSpacerItem, QSizePolicy)
-from PyQt6.QtCore import QTimer, Qt, QThread, pyqtSignal, QObject
-from PyQt6.QtGui import QFont, QTextCursor, QColor
+from PyQt6.QtWidgets import QApplication
 
-import NetworkThread
-import LoginWindow
-import RegistrationWindow
-import ChatWindow
 import ChatClient
 
-# Required for timestamp parsing
-from datetime import datetime
+StartupTimer.mark("imports")
 
 # --- Configuration ---
 SERVER_URL = "http://localhost:5000/api" # Base API URL
@@ -24,5 +15,6 @@ if __name__ == "__main__":
     app = QApplication(sys.argv)
 
     client = ChatClient.ChatClient()
+    StartupTimer.watch(client)
     client.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    sys.exit(app.exec())
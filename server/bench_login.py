@@ -0,0 +1,59 @@
+"""
+Login throughput benchmark.
+
+Registers a handful of users in a throwaway database and hammers
+ChatDatabase.authenticate_user from many threads (like Flask would),
+reporting logins/sec overall and per verifier core.
+
+    python bench_login.py --workers 4 --threads 16 --logins 400
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from chat_db import ChatDatabase
+from passwords import PasswordVerifier, VerifierBusy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="verifier processes")
+    parser.add_argument("--threads", type=int, default=16, help="concurrent request threads")
+    parser.add_argument("--logins", type=int, default=200, help="total login attempts")
+    parser.add_argument("--users", type=int, default=20)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    verifier = PasswordVerifier(workers=args.workers, max_pending=args.threads * 2, queue_timeout=30)
+    db = ChatDatabase(os.path.join(tmp_dir, "bench.db"), password_verifier=verifier)
+
+    names = [f"bench{i}" for i in range(args.users)]
+    for name in names:
+        db.register_user(name, "secret-" + name)
+
+    def login(i):
+        name = names[i % len(names)]
+        try:
+            return db.authenticate_user(name, "secret-" + name) is not None
+        except VerifierBusy:
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(login, range(args.logins)))
+    elapsed = time.perf_counter() - start
+    verifier.shutdown()
+
+    ok = sum(1 for r in results if r)
+    rejected = sum(1 for r in results if r is None)
+    rate = ok / elapsed if elapsed else 0.0
+    cores = max(1, args.workers)
+    print(f"workers={args.workers} threads={args.threads} logins={args.logins}")
+    print(f"ok={ok} rejected={rejected} failed={len(results) - ok - rejected}")
+    print(f"elapsed={elapsed:.2f}s  {rate:.1f} logins/sec  {rate / cores:.1f} logins/sec/core")
+
+
+if __name__ == "__main__":
+    main()
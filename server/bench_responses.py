@@ -0,0 +1,63 @@
+"""
+Response size/serialization benchmark.
+
+Builds message-history-like rows and reports, for each available JSON
+encoder (and MessagePack when installed) and compression, the
+encode/decode time and bytes on the wire.
+
+    python bench_responses.py --sizes 100 1000 10000
+"""
+import argparse
+import time
+
+from encoding import JSON_ENCODERS, compress, zstandard, msgpack, msgpack_dumps, msgpack_loads
+
+
+def make_rows(count):
+    return [
+        {
+            "id": i,
+            "sender": f"user{i % 97}#{i % 9999:04}",
+            "message": f"message number {i} " + "lorem ipsum " * (i % 5),
+            "timestamp": f"2025-01-01 12:{(i // 60) % 60:02}:{i % 60:02}",
+        }
+        for i in range(count)
+    ]
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    codecs = dict(JSON_ENCODERS)
+    if msgpack is not None:
+        codecs["msgpack"] = (msgpack_dumps, msgpack_loads)
+
+    encodings = ["gzip"] + (["zstd"] if zstandard else [])
+    print(f"{'rows':>6} {'encoder':<8} {'encode ms':>10} {'decode ms':>10} {'raw bytes':>10} "
+          + " ".join(f"{e + ' bytes':>11} {e + ' ms':>8}" for e in encodings))
+    for size in args.sizes:
+        rows = make_rows(size)
+        for name, (dumps, loads) in codecs.items():
+            raw, encode_time = timed(lambda: dumps(rows), args.repeat)
+            _, decode_time = timed(lambda: loads(raw), args.repeat)
+            line = f"{size:>6} {name:<8} {encode_time * 1000:>10.2f} {decode_time * 1000:>10.2f} {len(raw):>10}"
+            for enc in encodings:
+                packed, pack_time = timed(lambda: compress(raw, enc), args.repeat)
+                line += f" {len(packed):>11} {pack_time * 1000:>8.2f}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Private-message write throughput against the number of shard files.
+
+Creates a fresh database per run with synthetic users and friendships, then
+has several threads send DMs between random friend pairs through
+ChatDatabase.send_private_message. shards=0 is the unsharded main database.
+
+    python bench_shards.py --shards 0 1 2 4 8 --threads 8 --messages 2000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from chat_db import ChatDatabase
+
+
+def seed(path, users, pairs, rng):
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (id, username, tag, password) VALUES (?, ?, '0000', 'x')",
+        [(i, f"user{i}") for i in range(1, users + 1)]
+    )
+    friendships = set()
+    while len(friendships) < pairs:
+        a, b = rng.sample(range(1, users + 1), 2)
+        friendships.add((min(a, b), max(a, b)))
+    conn.executemany(
+        "INSERT INTO friends (requester_id, addressee_id, status) VALUES (?, ?, 'accepted')",
+        sorted(friendships)
+    )
+    conn.commit()
+    conn.close()
+    return sorted(friendships)
+
+
+def run(shards, args):
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        ChatDatabase(path)
+        pairs = seed(path, args.users, args.pairs, rng)
+        db = ChatDatabase(path, pm_shards=shards)
+
+        per_thread = args.messages // args.threads
+        errors = []
+
+        def worker(index):
+            local_rng = random.Random(args.seed + index)
+            try:
+                for n in range(per_thread):
+                    a, b = local_rng.choice(pairs)
+                    ok, msg, _ = db.send_private_message(a, b, f"message {n} from thread {index}")
+                    if not ok:
+                        errors.append(msg)
+            except Exception as e:
+                errors.append(str(e))
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        inbox_user = pairs[0][0]
+        start = time.perf_counter()
+        for _ in range(100):
+            db.get_private_inbox(inbox_user, 0, 200)
+        inbox_ms = (time.perf_counter() - start) * 10
+
+        sent = per_thread * args.threads - len(errors)
+        label = f"shards={shards}" if shards else "unsharded"
+        print(f"{label:>10}: {sent / elapsed:8.0f} msg/s  inbox {inbox_ms:.2f} ms/call  errors={len(errors)}")
+        db.password_verifier.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, nargs="+", default=[0, 1, 2, 4, 8])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--pairs", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    for shards in args.shards:
+        run(shards, args)
+
+
+if __name__ == "__main__":
+    main()
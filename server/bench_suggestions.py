@@ -0,0 +1,60 @@
+"""
+Friend-of-friend suggestion benchmark on a synthetic graph.
+
+Builds a random friendship graph, then measures cold (uncached) and warm
+suggestion queries and the cost of incremental edge updates.
+
+    python bench_suggestions.py --users 1000000 --degree 10
+"""
+import argparse
+import random
+import time
+
+from suggestions import FriendGraph
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--degree", type=int, default=10, help="average friends per user")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    edge_count = args.users * args.degree // 2
+
+    def edges():
+        for _ in range(edge_count):
+            yield rng.randrange(args.users), rng.randrange(args.users)
+
+    graph = FriendGraph()
+    start = time.perf_counter()
+    graph.build(edges())
+    build_time = time.perf_counter() - start
+    adjacency_bytes = sum(arr.buffer_info()[1] * arr.itemsize for arr in graph._adj.values())
+    print(f"users={args.users} edges={edge_count} build={build_time:.1f}s adjacency={adjacency_bytes / 2**20:.1f} MiB")
+
+    sample = [rng.randrange(args.users) for _ in range(args.queries)]
+    start = time.perf_counter()
+    for user in sample:
+        graph.suggestions(user)
+    cold = (time.perf_counter() - start) / len(sample)
+    start = time.perf_counter()
+    for user in sample:
+        graph.suggestions(user)
+    warm = (time.perf_counter() - start) / len(sample)
+    print(f"suggestions: cold {cold * 1e3:.3f} ms/query, cached {warm * 1e6:.1f} us/query")
+
+    start = time.perf_counter()
+    for _ in range(args.updates):
+        a, b = rng.choice(sample), rng.randrange(args.users)
+        graph.add_edge(a, b)
+        graph.remove_edge(a, b)
+    update = (time.perf_counter() - start) / (2 * args.updates)
+    print(f"incremental edge update: {update * 1e6:.1f} us/edge (with {len(sample)} cached users)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import hashlib
+import os
+import re
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+class BlobStore:
+    """
+    Content-addressed files on disk: <root>/<h[:2]>/<h[2:4]>/<sha256>.
+    Uploads are streamed chunk by chunk into a temp file while hashing, then
+    renamed into place; an identical upload just discards its temp file.
+    """
+
+    def __init__(self, root, max_bytes=100 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+    @staticmethod
+    def is_valid_hash(digest):
+        return isinstance(digest, str) and HASH_RE.match(digest) is not None
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return self.is_valid_hash(digest) and os.path.exists(self.path_for(digest))
+
+    def save_stream(self, stream):
+        """Consume a file-like stream; returns (sha256 hex, size, created)."""
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise BlobTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+                    sha.update(chunk)
+                    tmp.write(chunk)
+            digest = sha.hexdigest()
+            final_path = self.path_for(digest)
+            if os.path.exists(final_path):
+                os.remove(tmp_path)
+                return digest, size, False
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+            return digest, size, True
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -1,14 +1,48 @@
 import sqlite3
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import random
 
+from passwords import PasswordVerifier, needs_rehash
+from pm_shards import PrivateMessageShards
+
+# The public chat room every user sees
+GLOBAL_ROOM_ID = 1
+# Upper bound for "before_id" paging when no cursor is given
+MAX_MESSAGE_ID = 2 ** 63 - 1
+
+
+class AmbiguousUsername(Exception):
+    """Raised when a bare username matches several accounts; the caller must give username#tag."""
+
+
+def room_conversation(room_id):
+    return f"room:{room_id}"
+
+
+def dm_conversation(peer_id):
+    return f"dm:{peer_id}"
+
+
 class ChatDatabase:
-    def __init__(self, db_name="chat_app.db"):
+    def __init__(self, db_name="chat_app.db", password_verifier=None, pm_shards=0, pm_node=None):
         self.db_name = db_name
+        self.password_verifier = password_verifier or PasswordVerifier()
         self.conn = sqlite3.connect(self.db_name, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
         self.cursor = self.conn.cursor()
         self._create_tables()
+        # pm_shards > 0 moves private messages (and their unread counters) into separate files
+        self.pm_shards = PrivateMessageShards(self.db_name, pm_shards, pm_node) if pm_shards else None
+        if self.pm_shards and self.pm_shards.is_empty():
+            self.pm_shards.import_rows(list(self._iter_query(
+                """SELECT id, sender_id, receiver_id, message, timestamp, attachment, attachment_name
+                   FROM private_messages ORDER BY id"""
+            )))
+            self.pm_shards.import_cursors(self._iter_query(
+                """SELECT user_id, CAST(SUBSTR(conversation, 4) AS INTEGER) AS peer_id, last_read_id, unread
+                   FROM read_cursors WHERE conversation LIKE 'dm:%'"""
+            ))
 
     def _connect(self):
         conn = sqlite3.connect(self.db_name)
@@ -34,6 +68,34 @@ class ChatDatabase:
         last_id = cursor.lastrowid
         conn.close()
         return last_id
+
+    @contextmanager
+    def _transaction(self):
+        # Several statements that must commit together (e.g. insert + counter bump)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _iter_query(self, query, params=(), batch_size=500):
+        # Yields rows straight from the cursor so huge tables are never materialized
+        conn = self._connect()
+        try:
+            cursor = conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            conn.close()
     
     def _create_tables(self):
         queries = [
@@ -84,7 +146,60 @@ class ChatDatabase:
                 FOREIGN KEY (sender_id) REFERENCES users(id),
                 FOREIGN KEY (receiver_id) REFERENCES users(id)
             );
+            """,
+            # Inbox cursors walk these per-user indexes instead of scanning all DMs
+            "CREATE INDEX IF NOT EXISTS idx_private_messages_receiver ON private_messages(receiver_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_private_messages_sender ON private_messages(sender_id, id)",
+            # Unread tracking: counters are maintained on write so badge reads are O(1).
+            # DMs keep an explicit unread count; rooms compare the room's message
+            # total with the sequence number of the last message the user has read.
             """
+            CREATE TABLE IF NOT EXISTS read_cursors (
+                user_id INTEGER NOT NULL,
+                conversation TEXT NOT NULL,
+                last_read_id INTEGER NOT NULL DEFAULT 0,
+                seen_seq INTEGER NOT NULL DEFAULT 0,
+                unread INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, conversation)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS room_counters (
+                room_id INTEGER PRIMARY KEY,
+                total INTEGER NOT NULL DEFAULT 0
+            );
+            """,
+            # اتاق‌ها (کانال‌ها) و اعضای آن‌ها؛ اتاق عمومی برای همه باز است
+            """
+            CREATE TABLE IF NOT EXISTS rooms (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                created_by INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (created_by) REFERENCES users(id)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS room_members (
+                room_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (room_id, user_id),
+                FOREIGN KEY (room_id) REFERENCES rooms(id),
+                FOREIGN KEY (user_id) REFERENCES users(id)
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_room_members_user ON room_members(user_id, room_id)",
+            # فایل‌های پیوست؛ محتوای فایل روی دیسک با نام هش ذخیره می‌شود
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                content_type TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+            f"INSERT OR IGNORE INTO rooms (id, name) VALUES ({GLOBAL_ROOM_ID}, 'general')"
         ]
 
         for query in queries:
@@ -105,6 +220,32 @@ class ChatDatabase:
         if "responded_at" not in columns:
             cursor.execute("ALTER TABLE friends ADD COLUMN responded_at TIMESTAMP")
 
+        # شماره ترتیبی پیام داخل اتاق برای شمارش پیام‌های خوانده‌نشده
+        cursor.execute("PRAGMA table_info(messages)")
+        columns = [row["name"] for row in cursor.fetchall()]
+        if "room_id" not in columns:
+            cursor.execute(f"ALTER TABLE messages ADD COLUMN room_id INTEGER NOT NULL DEFAULT {GLOBAL_ROOM_ID}")
+        if "attachment" not in columns:
+            cursor.execute("ALTER TABLE messages ADD COLUMN attachment TEXT REFERENCES blobs(hash)")
+            cursor.execute("ALTER TABLE messages ADD COLUMN attachment_name TEXT")
+        cursor.execute("PRAGMA table_info(private_messages)")
+        if "attachment" not in [row["name"] for row in cursor.fetchall()]:
+            cursor.execute("ALTER TABLE private_messages ADD COLUMN attachment TEXT REFERENCES blobs(hash)")
+            cursor.execute("ALTER TABLE private_messages ADD COLUMN attachment_name TEXT")
+        # Each room is its own stream: cursors scan (room_id, id)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_room ON messages(room_id, id)")
+        if "seq" not in columns:
+            cursor.execute("ALTER TABLE messages ADD COLUMN seq INTEGER")
+            cursor.execute("""
+                UPDATE messages SET seq = numbered.rn
+                FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS rn FROM messages) AS numbered
+                WHERE messages.id = numbered.id
+            """)
+            cursor.execute(
+                "INSERT OR REPLACE INTO room_counters (room_id, total) SELECT ?, COUNT(*) FROM messages",
+                (GLOBAL_ROOM_ID,)
+            )
+
         conn.commit()
         conn.close()
 
@@ -122,9 +263,10 @@ class ChatDatabase:
 
     def register_user(self, username, password, email=None):
         tag = self._generate_tag(username)
+        password_hash = self.password_verifier.hash(password)
         query = "INSERT INTO users (username, tag, password, email) VALUES (?, ?, ?, ?)"
         try:
-            return self._execute_query(query, (username, tag, password, email))
+            return self._execute_query(query, (username, tag, password_hash, email))
         except sqlite3.IntegrityError:
             return None  # Duplicate username#tag
 
@@ -138,9 +280,57 @@ class ChatDatabase:
     def get_user_by_id(self, user_id):
         return self._execute_query("SELECT * FROM users WHERE id = ?", (user_id,), fetch_one=True)
 
+    # SQLite caps bound parameters (999 on older builds), so large batches are chunked
+    _BATCH_CHUNK = 400
+
+    def get_users_by_ids(self, user_ids):
+        users = []
+        ids = list(user_ids)
+        for i in range(0, len(ids), self._BATCH_CHUNK):
+            chunk = ids[i:i + self._BATCH_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            users += self._execute_query(
+                f"SELECT id, username, tag, last_activity FROM users WHERE id IN ({placeholders})",
+                chunk, fetch_all=True
+            )
+        return users
+
+    def get_users_by_handles(self, handles):
+        pairs = [tuple(h.split('#', 1)) for h in handles if '#' in h]
+        users = []
+        for i in range(0, len(pairs), self._BATCH_CHUNK):
+            chunk = pairs[i:i + self._BATCH_CHUNK]
+            values = ",".join("(?, ?)" for _ in chunk)
+            params = [part for pair in chunk for part in pair]
+            # Row-value IN uses the UNIQUE(username, tag) index
+            users += self._execute_query(
+                f"SELECT id, username, tag, last_activity FROM users WHERE (username, tag) IN (VALUES {values})",
+                params, fetch_all=True
+            )
+        return users
+
     def authenticate_user(self, username, password):
-        query = "SELECT * FROM users WHERE username = ? AND password = ?"
-        return self._execute_query(query, (username, password), fetch_one=True)
+        # username is either "username#tag" or a bare name that only one account uses;
+        # at most one password hash is checked per login attempt
+        if '#' in username:
+            user = self.get_user_by_username_tag(username)
+        else:
+            candidates = self._execute_query(
+                "SELECT * FROM users WHERE username = ? LIMIT 2", (username,), fetch_all=True
+            )
+            if len(candidates) > 1:
+                raise AmbiguousUsername(username)
+            user = candidates[0] if candidates else None
+
+        if user is None or not self.password_verifier.verify(password, user["password"]):
+            return None
+        # Legacy plaintext rows (and hashes with outdated cost) are upgraded on login
+        if needs_rehash(user["password"]):
+            self._execute_query(
+                "UPDATE users SET password = ? WHERE id = ?",
+                (self.password_verifier.hash(password), user["id"])
+            )
+        return user
 
     # ------------------ Friends ------------------
     def get_friend_requests(self, user_id):
@@ -178,6 +368,10 @@ class ChatDatabase:
         return self._execute_query(query, (user_id, user_id), fetch_all=True)
 
 
+    def iter_friend_edges(self):
+        for row in self._iter_query("SELECT requester_id, addressee_id FROM friends WHERE status = 'accepted'"):
+            yield row["requester_id"], row["addressee_id"]
+
     def are_friends(self, user_id_1, user_id_2):
         uid1, uid2 = sorted([user_id_1, user_id_2])
         query = "SELECT 1 FROM friends WHERE ((requester_id = ? AND addressee_id = ?) OR (requester_id = ? AND addressee_id = ?)) AND status = 'accepted'"
@@ -185,22 +379,132 @@ class ChatDatabase:
         return result is not None
 
     # ----------------- Messages ------------------
-    def add_message(self, sender_id, content):
-        return self._execute_query(
-            "INSERT INTO messages (sender_id, message) VALUES (?, ?)",
-            (sender_id, content)
+    def add_message(self, sender_id, content, room_id=GLOBAL_ROOM_ID, attachment=None, attachment_name=None):
+        with self._transaction() as conn:
+            seq = self._bump_room_counter(conn, room_id)
+            cursor = conn.execute(
+                """INSERT INTO messages (sender_id, message, seq, room_id, attachment, attachment_name)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (sender_id, content, seq, room_id, attachment, attachment_name)
+            )
+            # The sender has obviously read their own message
+            self._advance_room_cursor(conn, sender_id, room_id, cursor.lastrowid, seq)
+            return cursor.lastrowid
+
+    def _bump_room_counter(self, conn, room_id):
+        row = conn.execute(
+            """INSERT INTO room_counters (room_id, total) VALUES (?, 1)
+               ON CONFLICT(room_id) DO UPDATE SET total = total + 1
+               RETURNING total""",
+            (room_id,)
+        ).fetchone()
+        return row["total"]
+
+    def _advance_room_cursor(self, conn, user_id, room_id, message_id, seq):
+        conn.execute(
+            """INSERT INTO read_cursors (user_id, conversation, last_read_id, seen_seq) VALUES (?, ?, ?, ?)
+               ON CONFLICT(user_id, conversation) DO UPDATE SET
+                   last_read_id = MAX(last_read_id, excluded.last_read_id),
+                   seen_seq = MAX(seen_seq, excluded.seen_seq)""",
+            (user_id, room_conversation(room_id), message_id, seq)
         )
 
-    def get_recent_messages(self, since_id=0, limit=100):
+    def get_recent_messages(self, since_id=0, limit=100, room_id=GLOBAL_ROOM_ID):
         query = """
-            SELECT m.id, u.username || '#' || u.tag as sender, m.message, m.timestamp
+            SELECT m.id, m.room_id, m.sender_id, u.username || '#' || u.tag as sender, m.message, m.timestamp,
+                   m.attachment, m.attachment_name
             FROM messages m
             JOIN users u ON m.sender_id = u.id
-            WHERE m.id > ?
+            WHERE m.room_id = ? AND m.id > ?
             ORDER BY m.id ASC
             LIMIT ?
         """
-        return self._execute_query(query, (since_id, limit), fetch_all=True)
+        return self._execute_query(query, (room_id, since_id, limit), fetch_all=True)
+
+    def get_messages_before(self, before_id, limit=100, room_id=GLOBAL_ROOM_ID):
+        query = """
+            SELECT m.id, m.room_id, m.sender_id, u.username || '#' || u.tag as sender, m.message, m.timestamp,
+                   m.attachment, m.attachment_name
+            FROM messages m
+            JOIN users u ON m.sender_id = u.id
+            WHERE m.room_id = ? AND m.id < ?
+            ORDER BY m.id DESC
+            LIMIT ?
+        """
+        return self._execute_query(query, (room_id, before_id, limit), fetch_all=True)[::-1]
+
+    def get_latest_message_ids(self):
+        # One index seek per room thanks to idx_messages_room
+        rows = self._execute_query(
+            "SELECT room_id, MAX(id) AS latest FROM messages GROUP BY room_id", fetch_all=True
+        )
+        return {r["room_id"]: r["latest"] for r in rows}
+
+    # ----------------- Blobs ------------------
+    def add_blob(self, digest, size, content_type=None):
+        self._execute_query(
+            "INSERT OR IGNORE INTO blobs (hash, size, content_type) VALUES (?, ?, ?)",
+            (digest, size, content_type)
+        )
+
+    def get_blob(self, digest):
+        return self._execute_query("SELECT * FROM blobs WHERE hash = ?", (digest,), fetch_one=True)
+
+    # ----------------- Rooms ------------------
+    def create_room(self, name, creator_id):
+        try:
+            with self._transaction() as conn:
+                room_id = conn.execute(
+                    "INSERT INTO rooms (name, created_by) VALUES (?, ?)", (name, creator_id)
+                ).lastrowid
+                conn.execute("INSERT INTO room_members (room_id, user_id) VALUES (?, ?)", (room_id, creator_id))
+                conn.execute(
+                    "INSERT OR IGNORE INTO read_cursors (user_id, conversation) VALUES (?, ?)",
+                    (creator_id, room_conversation(room_id))
+                )
+                return room_id
+        except sqlite3.IntegrityError:
+            return None  # Duplicate room name
+
+    def get_room(self, room_id):
+        return self._execute_query("SELECT * FROM rooms WHERE id = ?", (room_id,), fetch_one=True)
+
+    def join_room(self, room_id, user_id):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO room_members (room_id, user_id) VALUES (?, ?)", (room_id, user_id))
+            # Start the unread cursor at the current end of the room
+            conn.execute(
+                """INSERT OR IGNORE INTO read_cursors (user_id, conversation, last_read_id, seen_seq)
+                   SELECT ?, ?, COALESCE((SELECT MAX(id) FROM messages WHERE room_id = ?), 0),
+                          COALESCE((SELECT total FROM room_counters WHERE room_id = ?), 0)""",
+                (user_id, room_conversation(room_id), room_id, room_id)
+            )
+
+    def leave_room(self, room_id, user_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM room_members WHERE room_id = ? AND user_id = ?", (room_id, user_id))
+            conn.execute(
+                "DELETE FROM read_cursors WHERE user_id = ? AND conversation = ?",
+                (user_id, room_conversation(room_id))
+            )
+
+    def is_room_member(self, room_id, user_id):
+        if room_id == GLOBAL_ROOM_ID:
+            return True
+        result = self._execute_query(
+            "SELECT 1 FROM room_members WHERE room_id = ? AND user_id = ?", (room_id, user_id), fetch_one=True
+        )
+        return result is not None
+
+    def get_user_rooms(self, user_id):
+        query = """
+            SELECT r.id, r.name FROM rooms r WHERE r.id = ?
+            UNION ALL
+            SELECT r.id, r.name FROM room_members m JOIN rooms r ON r.id = m.room_id
+            WHERE m.user_id = ? AND r.id != ?
+            ORDER BY id
+        """
+        return self._execute_query(query, (GLOBAL_ROOM_ID, user_id, GLOBAL_ROOM_ID), fetch_all=True)
     
         # ارسال درخواست دوستی
     def send_friend_request(self, requester_id, addressee_id):
@@ -278,7 +582,6 @@ class ChatDatabase:
             JOIN users u ON f.requester_id = u.id
             WHERE f.addressee_id = ? AND f.status = 'pending'
         """
-        print(self._execute_query(query, (user_id,), fetch_all=True))
         return self._execute_query(query, (user_id,), fetch_all=True)
 
 
@@ -295,6 +598,21 @@ class ChatDatabase:
     def get_all_users(self):
         query = "SELECT id, username, tag, email, created_at, last_activity FROM users ORDER BY id"
         return self._execute_query(query, fetch_all=True)
+
+    # Keyset pagination: pass the last id of the previous page as after_id
+    def get_users_page(self, after_id=0, limit=100):
+        query = """
+            SELECT id, username, tag, email, created_at, last_activity FROM users
+            WHERE id > ? ORDER BY id LIMIT ?
+        """
+        return self._execute_query(query, (after_id, limit), fetch_all=True)
+
+    def iter_users(self, after_id=0):
+        query = """
+            SELECT id, username, tag, email, created_at, last_activity FROM users
+            WHERE id > ? ORDER BY id
+        """
+        return self._iter_query(query, (after_id,))
     
     def get_statistics(self):
         total_users = self._execute_query("SELECT COUNT(*) as count FROM users", fetch_one=True)['count']
@@ -344,6 +662,32 @@ class ChatDatabase:
             WHERE f.status = 'accepted'
         """
         return self._execute_query(query, fetch_all=True)
+
+    _FRIENDSHIPS_AFTER = """
+        SELECT f.id, u1.username || '#' || u1.tag as user1, u2.username || '#' || u2.tag as user2,
+               f.status, f.responded_at
+        FROM friends f
+        JOIN users u1 ON f.requester_id = u1.id
+        JOIN users u2 ON f.addressee_id = u2.id
+        WHERE f.status = 'accepted' AND f.id > ?
+        ORDER BY f.id
+    """
+
+    _PENDING_REQUESTS_AFTER = """
+        SELECT f.id, u1.username || '#' || u1.tag AS requester, u2.username || '#' || u2.tag AS addressee,
+               f.requested_at
+        FROM friends f
+        JOIN users u1 ON f.requester_id = u1.id
+        JOIN users u2 ON f.addressee_id = u2.id
+        WHERE f.status = 'pending' AND f.id > ?
+        ORDER BY f.id
+    """
+
+    def get_all_friends_page(self, after_id=0, limit=100):
+        return self._execute_query(self._FRIENDSHIPS_AFTER + " LIMIT ?", (after_id, limit), fetch_all=True)
+
+    def get_all_pending_friend_requests_page(self, after_id=0, limit=100):
+        return self._execute_query(self._PENDING_REQUESTS_AFTER + " LIMIT ?", (after_id, limit), fetch_all=True)
     
     def update_activity(self, user_id):
         query = "UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE id = ?"
@@ -374,34 +718,153 @@ class ChatDatabase:
             return f"{result['username']}#{result['tag']}"
         return None
 
-    def send_private_message(self, sender_id, receiver_id, message):
+    def send_private_message(self, sender_id, receiver_id, message, attachment=None, attachment_name=None):
         if not self.are_friends(sender_id, receiver_id):
-            return False, "You can only message your friends."
-        query = "INSERT INTO private_messages (sender_id, receiver_id, message) VALUES (?, ?, ?)"
-        self._execute_query(query, (sender_id, receiver_id, message))
-        return True, "Message sent."
+            return False, "You can only message your friends.", None
+        if self.pm_shards:
+            message_id = self.pm_shards.send(sender_id, receiver_id, message, attachment, attachment_name)
+            return True, "Message sent.", message_id
+        with self._transaction() as conn:
+            message_id = conn.execute(
+                """INSERT INTO private_messages (sender_id, receiver_id, message, attachment, attachment_name)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (sender_id, receiver_id, message, attachment, attachment_name)
+            ).lastrowid
+            conn.execute(
+                """INSERT INTO read_cursors (user_id, conversation, unread) VALUES (?, ?, 1)
+                   ON CONFLICT(user_id, conversation) DO UPDATE SET unread = unread + 1""",
+                (receiver_id, dm_conversation(sender_id))
+            )
+        return True, "Message sent.", message_id
+
+    # ----------------- Unread counters ------------------
+    def mark_read(self, user_id, acks):
+        """
+        Apply a batch of read acknowledgements: [{"conversation": "dm:5" | "room:1", "last_read_id": N}].
+        Cursors only move forward.
+        """
+        with self._transaction() as conn:
+            for ack in acks:
+                conversation = str(ack.get("conversation", ""))
+                last_read_id = int(ack.get("last_read_id", 0))
+                kind, _, target = conversation.partition(":")
+                if not target.isdigit():
+                    continue
+                if kind == "room":
+                    row = conn.execute(
+                        "SELECT seq FROM messages WHERE id = ? AND room_id = ?", (last_read_id, int(target))
+                    ).fetchone()
+                    if row and row["seq"] is not None:
+                        self._advance_room_cursor(conn, user_id, int(target), last_read_id, row["seq"])
+                elif kind == "dm" and self.pm_shards:
+                    self.pm_shards.mark_read(user_id, int(target), last_read_id)
+                elif kind == "dm":
+                    # Only the messages still unread past the cursor are counted (index range scan)
+                    remaining = conn.execute(
+                        """SELECT COUNT(*) AS n FROM private_messages
+                           WHERE receiver_id = ? AND id > ? AND sender_id = ?""",
+                        (user_id, last_read_id, int(target))
+                    ).fetchone()["n"]
+                    conn.execute(
+                        """INSERT INTO read_cursors (user_id, conversation, last_read_id, unread) VALUES (?, ?, ?, ?)
+                           ON CONFLICT(user_id, conversation) DO UPDATE SET
+                               unread = CASE WHEN excluded.last_read_id > last_read_id THEN excluded.unread ELSE unread END,
+                               last_read_id = MAX(last_read_id, excluded.last_read_id)""",
+                        (user_id, conversation, last_read_id, remaining)
+                    )
+
+    def get_unread_counts(self, user_id):
+        """{conversation: unread} for every conversation with unread messages."""
+        rows = self._execute_query(
+            """
+            SELECT rc.conversation,
+                   CASE WHEN rc.conversation LIKE 'room:%'
+                        THEN COALESCE(c.total, 0) - rc.seen_seq
+                        ELSE rc.unread END AS unread
+            FROM read_cursors rc
+            LEFT JOIN room_counters c ON rc.conversation = 'room:' || c.room_id
+            WHERE rc.user_id = ? AND (? = 0 OR rc.conversation NOT LIKE 'dm:%')
+            """,
+            # With shards the DM cursors live there; rows left here from before the migration are stale
+            (user_id, 1 if self.pm_shards else 0), fetch_all=True
+        )
+        counts = {r["conversation"]: r["unread"] for r in rows if r["unread"] > 0}
+        if self.pm_shards:
+            counts.update({dm_conversation(peer): n for peer, n in self.pm_shards.unread_counts(user_id).items()})
+        if not any(r["conversation"] == room_conversation(GLOBAL_ROOM_ID) for r in rows):
+            # First look at the global room: start the user's cursor at the current end
+            self._execute_query(
+                """INSERT OR IGNORE INTO read_cursors (user_id, conversation, last_read_id, seen_seq)
+                   SELECT ?, ?, COALESCE((SELECT MAX(id) FROM messages WHERE room_id = ?), 0),
+                          COALESCE((SELECT total FROM room_counters WHERE room_id = ?), 0)""",
+                (user_id, room_conversation(GLOBAL_ROOM_ID), GLOBAL_ROOM_ID, GLOBAL_ROOM_ID)
+            )
+        return counts
     
-    def get_private_messages(self, user1_id, user2_id, limit=100):
+    def get_private_messages(self, user1_id, user2_id, limit=100, before_id=None):
+        if self.pm_shards:
+            return self.pm_shards.conversation(user1_id, user2_id, limit, before_id)
         query = """
             SELECT 
                 pm.id,
+                pm.sender_id,
                 u.username || '#' || u.tag AS sender,
                 pm.message,
-                pm.timestamp
+                pm.timestamp,
+                pm.attachment,
+                pm.attachment_name
             FROM private_messages pm
             JOIN users u ON pm.sender_id = u.id
             WHERE 
-                (pm.sender_id = ? AND pm.receiver_id = ?)
+                ((pm.sender_id = ? AND pm.receiver_id = ?)
                 OR
-                (pm.sender_id = ? AND pm.receiver_id = ?)
-            ORDER BY pm.timestamp DESC
+                (pm.sender_id = ? AND pm.receiver_id = ?))
+                AND pm.id < ?
+            ORDER BY pm.id DESC
             LIMIT ?
         """
-        rows = self._execute_query(query, (user1_id, user2_id, user2_id, user1_id, limit), fetch_all=True)
+        before_id = before_id if before_id is not None else MAX_MESSAGE_ID
+        rows = self._execute_query(
+            query, (user1_id, user2_id, user2_id, user1_id, before_id, limit), fetch_all=True
+        )
         # چون پیام‌ها رو برعکس گرفتیم، حالا برگردون به ترتیب درست
         return rows[::-1]
 
+    def get_private_inbox(self, user_id, since_id=0, limit=200):
+        if self.pm_shards:
+            return self.pm_shards.inbox(user_id, since_id, limit)
+        # Each branch is a range scan on its (user, id) index; UNION merges and dedups
+        query = """
+            SELECT
+                pm.id,
+                pm.sender_id,
+                pm.receiver_id,
+                u.username || '#' || u.tag AS sender,
+                pm.message,
+                pm.timestamp,
+                pm.attachment,
+                pm.attachment_name
+            FROM (
+                SELECT id FROM (
+                    SELECT id FROM private_messages WHERE receiver_id = ? AND id > ? ORDER BY id LIMIT ?
+                )
+                UNION
+                SELECT id FROM (
+                    SELECT id FROM private_messages WHERE sender_id = ? AND id > ? ORDER BY id LIMIT ?
+                )
+            ) ids
+            JOIN private_messages pm ON pm.id = ids.id
+            JOIN users u ON pm.sender_id = u.id
+            ORDER BY pm.id
+            LIMIT ?
+        """
+        return self._execute_query(
+            query, (user_id, since_id, limit, user_id, since_id, limit, limit), fetch_all=True
+        )
+
     def get_last_messages_with_friends(self, user_id):
+        if self.pm_shards:
+            return self.pm_shards.last_messages(user_id)
         query = """
             SELECT 
                 u.id as friend_id,
@@ -0,0 +1,114 @@
+import gzip
+import json
+import os
+
+# Optional accelerators; everything falls back to the standard library.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get("CHAT_COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPE = "application/msgpack"
+COMPRESSIBLE_MIMETYPES = {JSON_MIMETYPE, MSGPACK_MIMETYPE, "application/x-ndjson", "text/plain", "text/html"}
+
+
+# ----------------- JSON ------------------
+def _stdlib_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+JSON_ENCODERS = {"stdlib": (_stdlib_dumps, json.loads)}
+if orjson is not None:
+    JSON_ENCODERS["orjson"] = (_orjson_dumps, orjson.loads)
+
+
+def get_json_codec(name=None):
+    """(dumps, loads) pair; name defaults to CHAT_JSON_ENCODER, then the fastest available."""
+    name = name or os.environ.get("CHAT_JSON_ENCODER")
+    if name in JSON_ENCODERS:
+        return JSON_ENCODERS[name]
+    return JSON_ENCODERS["orjson" if "orjson" in JSON_ENCODERS else "stdlib"]
+
+
+json_dumps, json_loads = get_json_codec()
+
+
+# ----------------- MessagePack ------------------
+def msgpack_dumps(obj):
+    return msgpack.packb(obj, use_bin_type=True, default=str)
+
+
+def msgpack_loads(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+def wants_msgpack(accept_mimetypes):
+    """True when the client prefers MessagePack over JSON and we can produce it."""
+    if msgpack is None:
+        return False
+    # Only an explicit mention counts; "*/*" keeps getting JSON
+    quality = max((q for value, q in accept_mimetypes if value == MSGPACK_MIMETYPE), default=0)
+    return quality > 0 and quality >= accept_mimetypes[JSON_MIMETYPE]
+
+
+# ----------------- Compression ------------------
+_zstd_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL) if zstandard else None
+
+
+def compress(data, encoding):
+    if encoding == "zstd":
+        return _zstd_compressor.compress(data)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def choose_encoding(accept_encodings):
+    """
+    Pick the best encoding the client accepts.
+    accept_encodings is a mapping-like object returning the q-value of a name.
+    """
+    if _zstd_compressor is not None and accept_encodings["zstd"]:
+        return "zstd"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress_response(response, accept_encodings, min_bytes=COMPRESS_MIN_BYTES):
+    """Compress a buffered Flask/Werkzeug response in place when worthwhile."""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < min_bytes:
+        return response
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
@@ -0,0 +1,196 @@
+"""
+Publish/subscribe for server events (new messages, DMs, friend and presence changes).
+
+InProcessEventBus is enough for a single worker. With several worker processes,
+run the broker once and point every worker at it:
+
+    python event_bus.py broker /tmp/chat-events.sock
+    CHAT_EVENT_BUS=unix:/tmp/chat-events.sock python server.py
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+logger = logging.getLogger("chat_server_app.event_bus")
+
+DEFAULT_SOCKET_PATH = "/tmp/chat-events.sock"
+
+
+class InProcessEventBus:
+    """Synchronous fan-out to callbacks registered in this process."""
+
+    # Changes whenever the stream of other workers' events may have had a gap;
+    # None means this bus cannot see other workers' events at all
+    generation = None
+
+    def __init__(self):
+        self._subscribers = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic, callback):
+        with self._lock:
+            self._subscribers[topic].append(callback)
+
+    def unsubscribe(self, topic, callback):
+        with self._lock:
+            if callback in self._subscribers.get(topic, ()):
+                self._subscribers[topic].remove(callback)
+
+    def _dispatch(self, topic, payload):
+        with self._lock:
+            callbacks = list(self._subscribers.get(topic, ()))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception(f"Event handler for {topic!r} failed")
+
+    def publish(self, topic, payload):
+        self._dispatch(topic, payload)
+
+    def close(self):
+        pass
+
+
+class UnixSocketEventBus(InProcessEventBus):
+    """
+    Delivers locally right away and forwards the event to the broker, which
+    relays it to every other connected worker. Frames are JSON lines.
+    Reconnects in the background if the broker restarts; events published
+    while disconnected are only delivered locally.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH):
+        super().__init__()
+        self.path = path
+        self.origin = uuid.uuid4().hex
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._closed = False
+        self._connections = 0
+        self._connected = threading.Event()
+        self._reader = threading.Thread(target=self._read_loop, name="event-bus-reader", daemon=True)
+        self._reader.start()
+        self._connected.wait(1)
+
+    def publish(self, topic, payload):
+        self._dispatch(topic, payload)
+        frame = json.dumps({"topic": topic, "payload": payload, "origin": self.origin},
+                           separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._send_lock:
+            if self._sock is None:
+                return
+            try:
+                self._sock.sendall(frame)
+            except OSError:
+                logger.warning("Event broker connection lost while publishing")
+                self._drop_connection()
+
+    def _drop_connection(self):
+        sock, self._sock = self._sock, None
+        self.generation = None
+        self._connected.clear()
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _read_loop(self):
+        delay = 0.1
+        while not self._closed:
+            try:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(self.path)
+            except OSError:
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+                continue
+            delay = 0.1
+            with self._send_lock:
+                self._sock = sock
+                self._connections += 1
+                self.generation = self._connections
+            self._connected.set()
+            logger.info(f"Connected to event broker at {self.path}")
+            try:
+                for line in sock.makefile("rb"):
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    if event.get("origin") != self.origin:
+                        self._dispatch(event.get("topic"), event.get("payload"))
+            except OSError:
+                pass
+            with self._send_lock:
+                if self._sock is sock:
+                    self._drop_connection()
+
+    def close(self):
+        self._closed = True
+        with self._send_lock:
+            self._drop_connection()
+
+
+def create_event_bus(spec=None):
+    """CHAT_EVENT_BUS=unix:/path/to.sock selects the broker-backed bus; default is in-process."""
+    spec = spec if spec is not None else os.environ.get("CHAT_EVENT_BUS", "")
+    if spec.startswith("unix:"):
+        return UnixSocketEventBus(spec[len("unix:"):] or DEFAULT_SOCKET_PATH)
+    return InProcessEventBus()
+
+
+# ----------------- Broker ------------------
+async def _serve(path):
+    clients = set()
+
+    async def handle(reader, writer):
+        clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for other in list(clients):
+                    if other is writer:
+                        continue
+                    try:
+                        other.write(line)
+                    except Exception:
+                        clients.discard(other)
+                # Apply backpressure to this publisher if its peers are slow
+                await asyncio.gather(*(c.drain() for c in list(clients) if c is not writer),
+                                     return_exceptions=True)
+        finally:
+            clients.discard(writer)
+            writer.close()
+
+    if os.path.exists(path):
+        os.remove(path)
+    server = await asyncio.start_unix_server(handle, path=path)
+    logger.info(f"Event broker listening on {path}")
+    async with server:
+        await server.serve_forever()
+
+
+def run_broker(path=DEFAULT_SOCKET_PATH):
+    try:
+        asyncio.run(_serve(path))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) >= 2 and sys.argv[1] == "broker":
+        run_broker(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_SOCKET_PATH)
+    else:
+        print(__doc__)
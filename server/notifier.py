@@ -0,0 +1,65 @@
+import threading
+import time
+
+
+class RoomNotifier:
+    """
+    Wakes long-polling clients when a room they follow gets a new message.
+    Each waiter registers a private Event under the rooms it follows, so a
+    publish only touches the waiters of that one room.
+    """
+
+    def __init__(self, latest=None):
+        self._latest = dict(latest or {})  # room_id -> newest message id
+        self._waiters = {}                 # room_id -> set of Events
+        self._lock = threading.Lock()
+
+    def latest(self, room_id):
+        return self._latest.get(room_id, 0)
+
+    def publish(self, room_id, message_id):
+        with self._lock:
+            if message_id <= self._latest.get(room_id, 0):
+                return
+            self._latest[room_id] = message_id
+            waiters = list(self._waiters.get(room_id, ()))
+        for event in waiters:
+            event.set()
+
+    def _changed(self, cursors):
+        return {room: self._latest[room] for room, last_id in cursors.items()
+                if self._latest.get(room, 0) > last_id}
+
+    def wait(self, cursors, timeout):
+        """
+        Block until any room in cursors ({room_id: last_seen_id}) has a newer
+        message, or timeout. Returns {room_id: newest_id} for the rooms that moved.
+        """
+        event = threading.Event()
+        with self._lock:
+            changed = self._changed(cursors)
+            if changed:
+                return changed
+            for room in cursors:
+                self._waiters.setdefault(room, set()).add(event)
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not event.wait(remaining):
+                    break
+                event.clear()
+                with self._lock:
+                    changed = self._changed(cursors)
+                if changed:
+                    break
+        finally:
+            with self._lock:
+                for room in cursors:
+                    waiters = self._waiters.get(room)
+                    if waiters is not None:
+                        waiters.discard(event)
+                        if not waiters:
+                            del self._waiters[room]
+                changed = self._changed(cursors)
+        return changed
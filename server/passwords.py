@@ -0,0 +1,116 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Stored format: scrypt$<n>$<r>$<p>$<salt b64>$<hash b64>
+SCHEME = "scrypt"
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+# Cost parameters can be tuned per deployment without code changes.
+SCRYPT_N = int(os.environ.get("CHAT_SCRYPT_N", 2 ** 14))
+SCRYPT_R = int(os.environ.get("CHAT_SCRYPT_R", 8))
+SCRYPT_P = int(os.environ.get("CHAT_SCRYPT_P", 1))
+
+
+class VerifierBusy(Exception):
+    """Raised when too many hash/verify jobs are already queued."""
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode("ascii")
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(
+        password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+        maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=HASH_BYTES
+    )
+
+
+def hash_password(password, n=None, r=None, p=None):
+    n = n or SCRYPT_N
+    r = r or SCRYPT_R
+    p = p or SCRYPT_P
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, n, r, p)
+    return f"{SCHEME}${n}${r}${p}${_b64(salt)}${_b64(digest)}"
+
+
+def is_hashed(stored):
+    return isinstance(stored, str) and stored.startswith(SCHEME + "$")
+
+
+def verify_password(password, stored):
+    if not is_hashed(stored):
+        # Legacy plaintext row; compare in constant time anyway.
+        return hmac.compare_digest(str(stored).encode("utf-8"), password.encode("utf-8"))
+    try:
+        _, n, r, p, salt, digest = stored.split("$")
+        expected = base64.b64decode(digest)
+        actual = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def needs_rehash(stored):
+    """True for plaintext rows and for hashes made with other cost settings."""
+    if not is_hashed(stored):
+        return True
+    try:
+        _, n, r, p, _, _ = stored.split("$")
+    except ValueError:
+        return True
+    return (int(n), int(r), int(p)) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+class PasswordVerifier:
+    """
+    Runs scrypt in a process pool so slow hashing never holds a Flask thread's GIL.
+    At most max_pending jobs may be queued; further callers wait up to
+    queue_timeout seconds and then get VerifierBusy (mapped to 503 by the server).
+    workers=0 runs everything inline, which is handy for scripts.
+    """
+
+    def __init__(self, workers=None, max_pending=None, queue_timeout=0.5):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_pending = max_pending or max(1, self.workers) * 4
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise VerifierBusy("Password verification queue is full")
+        try:
+            if self.workers == 0:
+                return fn(*args)
+            return self._get_pool().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def verify(self, password, stored):
+        if not is_hashed(stored):
+            # Plaintext comparison is cheap; no need to cross a process boundary.
+            return verify_password(password, stored)
+        return self._run(verify_password, password, stored)
+
+    def hash(self, password):
+        return self._run(hash_password, password, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
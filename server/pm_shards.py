@@ -0,0 +1,273 @@
+import heapq
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from itertools import islice
+from urllib.request import pathname2url
+
+# Snowflake-style ids: milliseconds | sequence | node. They are unique across
+# shards, and across processes as long as every worker gets its own node id
+# (CHAT_PM_NODE). Within a shard they grow in commit order.
+NODE_BITS = 8
+SEQ_BITS = 12
+TIME_SHIFT = NODE_BITS + SEQ_BITS
+MAX_ID = 2 ** 63 - 1
+# Inbox reads skip ids newer than this, so a message that another worker
+# numbered but has not committed yet is not jumped over by a since_id cursor
+COMMIT_LAG_MS = 500
+
+_SHARD_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS private_messages (
+        id INTEGER PRIMARY KEY,
+        sender_id INTEGER NOT NULL,
+        receiver_id INTEGER NOT NULL,
+        message TEXT NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        attachment TEXT,
+        attachment_name TEXT
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_private_messages_receiver ON private_messages(receiver_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_private_messages_sender ON private_messages(sender_id, id)",
+    # Both directions of a conversation live in the same shard, so its unread counters do too
+    """
+    CREATE TABLE IF NOT EXISTS dm_unread (
+        user_id INTEGER NOT NULL,
+        peer_id INTEGER NOT NULL,
+        last_read_id INTEGER NOT NULL DEFAULT 0,
+        unread INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, peer_id)
+    );
+    """,
+]
+
+_MESSAGE_COLUMNS = """
+    pm.id, pm.sender_id, pm.receiver_id, u.username || '#' || u.tag AS sender,
+    pm.message, pm.timestamp, pm.attachment, pm.attachment_name
+"""
+
+
+def _file_uri(path, query=""):
+    uri = "file:" + pathname2url(os.path.abspath(path))
+    return f"{uri}?{query}" if query else uri
+
+
+class PrivateMessageShards:
+    """
+    Stores private messages in N SQLite files (<db>.pm<i>.db), routed by the
+    conversation's user pair. Each shard has its own write lock, so DMs in
+    different conversations commit in parallel. The main database is
+    ATTACHed read-only as "core" for joins against users.
+    """
+
+    def __init__(self, main_db_path, count, node_id=None, commit_lag_ms=COMMIT_LAG_MS):
+        self.main_db_path = main_db_path
+        self.count = count
+        base, _ = os.path.splitext(main_db_path)
+        self.paths = [f"{base}.pm{i}.db" for i in range(count)]
+        self._write_locks = [threading.Lock() for _ in range(count)]
+        self._local = threading.local()
+        self._id_lock = threading.Lock()
+        self._pending = set()
+        if node_id is None:
+            # Only safe with a single server process; multi-worker deployments set a node per worker
+            node_id = os.getpid() % (1 << NODE_BITS)
+        if not 0 <= int(node_id) < (1 << NODE_BITS):
+            raise ValueError(f"node_id must be between 0 and {(1 << NODE_BITS) - 1}")
+        self._node = int(node_id)
+        self.commit_lag_ms = commit_lag_ms
+        self._last_ms = 0
+        self._seq = 0
+
+        for path in self.paths:
+            conn = sqlite3.connect(path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            for query in _SHARD_SCHEMA:
+                conn.execute(query)
+            conn.commit()
+            conn.close()
+
+    # ----------------- Plumbing ------------------
+    def _conn(self, shard):
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get(shard)
+        if conn is None:
+            # URI filenames (uri=True) let the main database be attached with mode=ro
+            conn = sqlite3.connect(_file_uri(self.paths[shard]), timeout=30, uri=True)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("ATTACH DATABASE ? AS core", (_file_uri(self.main_db_path, "mode=ro"),))
+            conns[shard] = conn
+        return conn
+
+    def _fetch(self, shard, query, params=()):
+        return [dict(r) for r in self._conn(shard).execute(query, params).fetchall()]
+
+    def shard_for(self, user_a, user_b):
+        low, high = sorted((int(user_a), int(user_b)))
+        return zlib.crc32(f"{low}:{high}".encode("ascii")) % self.count
+
+    def _next_id(self, floor):
+        # floor is the shard's current MAX(id), read inside its write transaction, so
+        # ids in a shard grow in commit order even when several processes write to it
+        with self._id_lock:
+            floor_ms = floor >> TIME_SHIFT
+            ms = max(int(time.time() * 1000), self._last_ms, floor_ms)
+            seq = self._seq + 1 if ms == self._last_ms else 0
+            if ms == floor_ms:
+                seq = max(seq, ((floor >> NODE_BITS) & ((1 << SEQ_BITS) - 1)) + 1)
+            if seq >= (1 << SEQ_BITS):
+                ms, seq = ms + 1, 0
+            self._last_ms, self._seq = ms, seq
+            candidate = (ms << TIME_SHIFT) | (seq << NODE_BITS) | self._node
+            self._pending.add(candidate)
+            return candidate
+
+    def _watermark(self):
+        # Readers must not move a cursor past ids handed out but not committed yet:
+        # this process's are tracked exactly, other workers' are covered by the lag window
+        horizon = (int(time.time() * 1000) - self.commit_lag_ms) << TIME_SHIFT
+        with self._id_lock:
+            return min([horizon] + list(self._pending))
+
+    # ----------------- Writes ------------------
+    def send(self, sender_id, receiver_id, message, attachment=None, attachment_name=None):
+        shard = self.shard_for(sender_id, receiver_id)
+        conn = self._conn(shard)
+        with self._write_locks[shard]:
+            message_id = None
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                message_id = self._next_id(conn.execute("SELECT MAX(id) FROM private_messages").fetchone()[0] or 0)
+                conn.execute(
+                    """INSERT INTO private_messages (id, sender_id, receiver_id, message, attachment, attachment_name)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    (message_id, sender_id, receiver_id, message, attachment, attachment_name)
+                )
+                conn.execute(
+                    """INSERT INTO dm_unread (user_id, peer_id, unread) VALUES (?, ?, 1)
+                       ON CONFLICT(user_id, peer_id) DO UPDATE SET unread = unread + 1""",
+                    (receiver_id, sender_id)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                with self._id_lock:
+                    self._pending.discard(message_id)
+        return message_id
+
+    def mark_read(self, user_id, peer_id, last_read_id):
+        shard = self.shard_for(user_id, peer_id)
+        conn = self._conn(shard)
+        with self._write_locks[shard]:
+            remaining = conn.execute(
+                "SELECT COUNT(*) FROM private_messages WHERE receiver_id = ? AND id > ? AND sender_id = ?",
+                (user_id, last_read_id, peer_id)
+            ).fetchone()[0]
+            conn.execute(
+                """INSERT INTO dm_unread (user_id, peer_id, last_read_id, unread) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(user_id, peer_id) DO UPDATE SET
+                       unread = CASE WHEN excluded.last_read_id > last_read_id THEN excluded.unread ELSE unread END,
+                       last_read_id = MAX(last_read_id, excluded.last_read_id)""",
+                (user_id, peer_id, last_read_id, remaining)
+            )
+            conn.commit()
+
+    def import_rows(self, rows):
+        """Copy existing private_messages rows (keeping their ids) into their shards."""
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(self.shard_for(row["sender_id"], row["receiver_id"]), []).append(row)
+        for shard, shard_rows in by_shard.items():
+            conn = self._conn(shard)
+            with self._write_locks[shard]:
+                conn.executemany(
+                    """INSERT OR IGNORE INTO private_messages
+                       (id, sender_id, receiver_id, message, timestamp, attachment, attachment_name)
+                       VALUES (:id, :sender_id, :receiver_id, :message, :timestamp, :attachment, :attachment_name)""",
+                    shard_rows
+                )
+                conn.commit()
+
+    def import_cursors(self, rows):
+        """Copy existing DM read cursors: rows of {user_id, peer_id, last_read_id, unread}."""
+        for row in rows:
+            shard = self.shard_for(row["user_id"], row["peer_id"])
+            conn = self._conn(shard)
+            with self._write_locks[shard]:
+                conn.execute(
+                    """INSERT OR IGNORE INTO dm_unread (user_id, peer_id, last_read_id, unread)
+                       VALUES (:user_id, :peer_id, :last_read_id, :unread)""",
+                    row
+                )
+                conn.commit()
+
+    def is_empty(self):
+        return all(not self._fetch(i, "SELECT 1 FROM private_messages LIMIT 1") for i in range(self.count))
+
+    # ----------------- Reads ------------------
+    def conversation(self, user1_id, user2_id, limit=100, before_id=None):
+        rows = self._fetch(
+            self.shard_for(user1_id, user2_id),
+            f"""SELECT {_MESSAGE_COLUMNS}
+                FROM private_messages pm JOIN core.users u ON pm.sender_id = u.id
+                WHERE ((pm.sender_id = ? AND pm.receiver_id = ?) OR (pm.sender_id = ? AND pm.receiver_id = ?))
+                  AND pm.id < ?
+                ORDER BY pm.id DESC LIMIT ?""",
+            (user1_id, user2_id, user2_id, user1_id, MAX_ID if before_id is None else before_id, limit)
+        )
+        return rows[::-1]
+
+    def inbox(self, user_id, since_id=0, limit=200):
+        watermark = self._watermark()
+        query = f"""
+            SELECT {_MESSAGE_COLUMNS}
+            FROM (
+                SELECT id FROM (
+                    SELECT id FROM private_messages WHERE receiver_id = ? AND id > ? AND id < ? ORDER BY id LIMIT ?
+                )
+                UNION
+                SELECT id FROM (
+                    SELECT id FROM private_messages WHERE sender_id = ? AND id > ? AND id < ? ORDER BY id LIMIT ?
+                )
+            ) ids
+            JOIN private_messages pm ON pm.id = ids.id
+            JOIN core.users u ON pm.sender_id = u.id
+            ORDER BY pm.id
+            LIMIT ?
+        """
+        params = (user_id, since_id, watermark, limit, user_id, since_id, watermark, limit, limit)
+        per_shard = [self._fetch(i, query, params) for i in range(self.count)]
+        # Each shard's page is already sorted by id; a k-way merge keeps the global order
+        return list(islice(heapq.merge(*per_shard, key=lambda r: r["id"]), limit))
+
+    def last_messages(self, user_id):
+        query = """
+            SELECT u.id AS friend_id, u.username || '#' || u.tag AS friend, pm.message, pm.timestamp
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY CASE WHEN sender_id = ? THEN receiver_id ELSE sender_id END
+                    ORDER BY id DESC
+                ) AS rn
+                FROM private_messages WHERE sender_id = ? OR receiver_id = ?
+            ) pm
+            JOIN core.users u ON u.id = CASE WHEN pm.sender_id = ? THEN pm.receiver_id ELSE pm.sender_id END
+            WHERE rn = 1
+            ORDER BY pm.timestamp DESC
+        """
+        per_shard = [self._fetch(i, query, (user_id,) * 4) for i in range(self.count)]
+        return list(heapq.merge(*per_shard, key=lambda r: r["timestamp"], reverse=True))
+
+    def unread_counts(self, user_id):
+        counts = {}
+        for i in range(self.count):
+            for row in self._fetch(i, "SELECT peer_id, unread FROM dm_unread WHERE user_id = ? AND unread > 0", (user_id,)):
+                counts[row["peer_id"]] = row["unread"]
+        return counts
@@ -0,0 +1,131 @@
+import math
+import threading
+import time
+from collections import Counter
+
+# Priority classes, lower value = more important (shed last)
+PRIORITY_SEND = 0
+PRIORITY_READ = 1
+PRIORITY_PING = 2
+
+PRIORITY_NAMES = {PRIORITY_SEND: "send", PRIORITY_READ: "read", PRIORITY_PING: "ping"}
+
+# route -> (priority, refill per second, burst). Unlisted routes are reads.
+DEFAULT_ROUTE_LIMITS = {
+    "/api/login": (PRIORITY_SEND, 0.5, 5),
+    "/api/register": (PRIORITY_SEND, 0.2, 3),
+    "/api/messages/send": (PRIORITY_SEND, 2, 10),
+    "/api/private/send": (PRIORITY_SEND, 2, 10),
+    "/api/friends/request": (PRIORITY_SEND, 0.5, 5),
+    "/api/friends/respond": (PRIORITY_SEND, 1, 10),
+    "/api/friends/remove": (PRIORITY_SEND, 1, 5),
+    "/api/users/activity": (PRIORITY_PING, 0.2, 2),
+}
+DEFAULT_READ_LIMIT = (PRIORITY_READ, 5, 20)
+
+# Fraction of max_in_flight at which each class starts being shed
+DEFAULT_SHED_AT = {PRIORITY_PING: 0.5, PRIORITY_READ: 0.8, PRIORITY_SEND: 1.0}
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now, cost=1):
+        """Return 0 if a token was taken, else seconds until one is available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0
+        return (cost - self.tokens) / self.rate
+
+    def idle_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter:
+    """
+    In-process admission control.
+    Every request passes a per-user bucket and a per-(user, route) bucket.
+    Independently, when the number of in-flight requests crosses a class's
+    threshold, requests of that class are shed so sends keep getting through.
+    """
+
+    def __init__(self, user_rate=10, user_burst=40, route_limits=None,
+                 read_limit=DEFAULT_READ_LIMIT, max_in_flight=64, shed_at=None):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.route_limits = DEFAULT_ROUTE_LIMITS if route_limits is None else route_limits
+        self.read_limit = read_limit
+        self.max_in_flight = max_in_flight
+        self.shed_at = shed_at or DEFAULT_SHED_AT
+
+        self.in_flight = 0
+        self.counters = Counter()
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def classify(self, route):
+        return self.route_limits.get(route, self.read_limit)
+
+    def _bucket(self, key, rate, capacity, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, capacity, now)
+        return bucket
+
+    def _sweep(self, now):
+        # Full buckets carry no state, so they can be dropped and recreated on demand
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        for key in [k for k, b in self._buckets.items() if b.idle_full(now)]:
+            del self._buckets[key]
+
+    def acquire(self, client_key, route):
+        """
+        Admit a request. Returns (allowed, retry_after_seconds, reason).
+        A successful acquire must be paired with release().
+        """
+        priority, route_rate, route_burst = self.classify(route)
+        name = PRIORITY_NAMES[priority]
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            limit = self.max_in_flight * self.shed_at[priority]
+            if self.in_flight >= limit:
+                self.counters[f"shed_{name}"] += 1
+                return False, 1, "overloaded"
+
+            wait = self._bucket((client_key, route), route_rate, route_burst, now).take(now)
+            if not wait:
+                wait = self._bucket(client_key, self.user_rate, self.user_burst, now).take(now)
+                if wait:
+                    # Give back the route token so a throttled user is not charged twice
+                    self._buckets[(client_key, route)].tokens += 1
+            if wait:
+                self.counters[f"limited_{name}"] += 1
+                return False, max(1, math.ceil(wait)), "rate_limited"
+
+            self.in_flight += 1
+            self.counters[f"admitted_{name}"] += 1
+            return True, 0, None
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.counters)
+            data["in_flight"] = self.in_flight
+            data["max_in_flight"] = self.max_in_flight
+            data["buckets"] = len(self._buckets)
+        return data
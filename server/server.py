@@ -4,8 +4,10 @@ import socket
 import sys
 import os
 import logging
+from functools import wraps
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, has_request_context, Response, stream_with_context, send_file
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import customtkinter as ctk
 
@@ -18,7 +20,19 @@ app_logger = logging.getLogger('chat_server_app')
 
 # ---------- Import ChatDatabase ----------
 try:
-    from chat_db import ChatDatabase
+    from chat_db import ChatDatabase, AmbiguousUsername, GLOBAL_ROOM_ID
+    from passwords import VerifierBusy
+    from sessions import SessionManager
+    from rate_limit import RateLimiter
+    from user_search import UsernameIndex
+    from suggestions import FriendGraph
+    from notifier import RoomNotifier
+    from blob_store import BlobStore, BlobTooLarge
+    from event_bus import create_event_bus
+    from encoding import (
+        json_dumps, json_loads, compress_response,
+        msgpack, msgpack_dumps, msgpack_loads, wants_msgpack, MSGPACK_MIMETYPE
+    )
     app_logger.info("Successfully imported ChatDatabase from chat_db.py")
 except ImportError:
     app_logger.critical("\n--- CRITICAL ERROR ---")
@@ -31,15 +45,213 @@ except Exception as e:
     sys.exit(1)
 
 # ---------- Initialize Database ----------
-db = ChatDatabase()
+# CHAT_PM_SHARDS=N stores private messages in N separate SQLite files (0 = main database).
+# With several server processes, give each one its own CHAT_PM_NODE (0-255) so DM ids never collide.
+db = ChatDatabase(
+    pm_shards=int(os.environ.get("CHAT_PM_SHARDS", 0)),
+    pm_node=int(os.environ["CHAT_PM_NODE"]) if os.environ.get("CHAT_PM_NODE") else None
+)
 app_logger.info("ChatDatabase instance initialized.")
+sessions = SessionManager()
+username_index = UsernameIndex()
+_index_started = time.perf_counter()
+username_index.build(db.iter_users())
+app_logger.info(f"Username index built: {len(username_index)} users in {time.perf_counter() - _index_started:.2f}s")
+friend_graph = FriendGraph()
+friend_graph.build(db.iter_friend_edges())
+room_notifier = RoomNotifier(db.get_latest_message_ids())
+
+# ---------- Event Bus ----------
+# Every state change that another worker may care about goes through the bus;
+# the handlers below keep this worker's in-memory indexes and waiters current.
+event_bus = create_event_bus()
+online_users_cache = {"users": None, "expires": 0.0}
+ONLINE_USERS_TTL = 5
+
+
+def _on_message_event(event):
+    room_notifier.publish(event["room_id"], event["id"])
+
+
+def _on_private_message_event(event):
+    room_notifier.publish(("inbox", event["sender_id"]), event["id"])
+    room_notifier.publish(("inbox", event["receiver_id"]), event["id"])
+
+
+def _on_friend_event(event):
+    if event["action"] == "added":
+        friend_graph.add_edge(event["a"], event["b"])
+    else:
+        friend_graph.remove_edge(event["a"], event["b"])
+
+
+def _on_user_event(event):
+    username_index.add(event["id"], event["username"], event["tag"])
+
+
+def _on_presence_event(event):
+    # Someone just became active: the cached online list is stale
+    online_users_cache["expires"] = 0.0
+
+
+# The notifier only hears about other workers' messages through the broker. While that
+# stream may have gaps (no broker, or a dropped connection), the newest ids are re-read
+# from the database before the notifier is trusted to answer a poll on its own.
+NOTIFIER_RESYNC_SECONDS = 1.0
+_notifier_sync = {"generation": None, "at": 0.0}
+_notifier_sync_lock = threading.Lock()
+
+
+def room_latest(room_id):
+    with _notifier_sync_lock:
+        generation = event_bus.generation
+        if generation is None:
+            stale = time.monotonic() - _notifier_sync["at"] > NOTIFIER_RESYNC_SECONDS
+        else:
+            stale = generation != _notifier_sync["generation"]
+        if stale:
+            for room, latest in db.get_latest_message_ids().items():
+                room_notifier.publish(room, latest)
+            _notifier_sync.update(generation=generation, at=time.monotonic())
+    return room_notifier.latest(room_id)
+
+
+event_bus.subscribe("message", _on_message_event)
+event_bus.subscribe("private_message", _on_private_message_event)
+event_bus.subscribe("friend", _on_friend_event)
+event_bus.subscribe("user", _on_user_event)
+event_bus.subscribe("presence", _on_presence_event)
+blob_store = BlobStore(
+    os.environ.get("CHAT_BLOB_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "blobs")),
+    max_bytes=int(os.environ.get("CHAT_MAX_UPLOAD_BYTES", 100 * 1024 * 1024))
+)
+rate_limiter = RateLimiter(max_in_flight=int(os.environ.get("CHAT_MAX_IN_FLIGHT", 64)))
 
 # ---------- Flask App Setup ----------
+class FastJSONProvider(DefaultJSONProvider):
+    # Serializes with the codec picked in encoding.py (orjson when installed)
+    def dumps(self, obj, **kwargs):
+        return json_dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return json_loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if has_request_context() and wants_msgpack(request.accept_mimetypes):
+            response = self._app.response_class(msgpack_dumps(obj), mimetype=MSGPACK_MIMETYPE)
+        else:
+            response = self._app.response_class(json_dumps(obj), mimetype=self.mimetype)
+        response.vary.add("Accept")
+        return response
+
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)  # Enable Cross-Origin Resource Sharing for all domains
 
+
+@app.after_request
+def compress_api_response(response):
+    return compress_response(response, request.accept_encodings)
+
+
+@app.before_request
+def reject_unsupported_body():
+    # A MessagePack body this server cannot decode must not be read as an empty request
+    if request.mimetype == MSGPACK_MIMETYPE and msgpack is None and request.content_length:
+        return jsonify({"message": "MessagePack request bodies are not supported; send JSON"}), 415
+    return None
+
+
+def read_body():
+    # Request bodies may be JSON or MessagePack (Content-Type: application/msgpack)
+    if request.mimetype == MSGPACK_MIMETYPE and msgpack is not None:
+        try:
+            data = msgpack_loads(request.get_data())
+        except Exception:
+            data = None
+    else:
+        data = request.get_json(force=True, silent=True)
+    return data if isinstance(data, dict) else {}
+
+# ------------------ Authentication ------------------
+
+@app.before_request
+def resolve_session():
+    # Resolve "Authorization: Bearer <token>" to a cached identity without touching the DB
+    g.user = None
+    header = request.headers.get("Authorization", "")
+    if header.startswith("Bearer "):
+        user_id = sessions.validate(header[7:].strip())
+        if user_id is not None:
+            g.user = sessions.identity(user_id, db.get_user_by_id)
+
+
+def require_auth(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if g.user is None:
+            return jsonify({"message": "Authentication required"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+# ------------------ Rate Limiting ------------------
+
+LONG_POLL_ROUTES = {"/api/rooms/wait"}
+
+@app.before_request
+def apply_rate_limit():
+    # Runs after resolve_session so authenticated users are limited per account
+    g.rate_slot = False
+    if not request.path.startswith("/api/") or request.path == "/api/metrics":
+        return None
+    client_key = f"user:{g.user['id']}" if g.user else f"ip:{request.remote_addr}"
+    route = request.url_rule.rule if request.url_rule else request.path
+    allowed, retry_after, reason = rate_limiter.acquire(client_key, route)
+    if not allowed:
+        response = jsonify({"message": "Too many requests", "reason": reason})
+        response.headers["Retry-After"] = str(retry_after)
+        return response, 429 if reason == "rate_limited" else 503
+    if route in LONG_POLL_ROUTES:
+        # Parked long-polls are idle, they must not count towards overload shedding
+        rate_limiter.release()
+    else:
+        g.rate_slot = True
+    return None
+
+
+@app.teardown_request
+def release_rate_slot(exc=None):
+    if g.pop("rate_slot", False):
+        rate_limiter.release()
+
+
+# Polled endpoints get an X-Poll-Interval hint (ms) that stretches as the server fills up
+POLLED_ROUTES = {"/api/messages", "/api/users/online", "/api/private/inbox", "/api/unread"}
+BASE_POLL_INTERVAL_MS = int(os.environ.get("CHAT_POLL_INTERVAL_MS", 1000))
+
+@app.after_request
+def add_poll_hint(response):
+    if request.path in POLLED_ROUTES:
+        load = rate_limiter.in_flight / max(rate_limiter.max_in_flight, 1)
+        response.headers["X-Poll-Interval"] = str(int(BASE_POLL_INTERVAL_MS * (1 + 4 * load)))
+    return response
+
+
+@app.route("/api/metrics", methods=["GET"])
+def api_metrics():
+    return jsonify({"rate_limit": rate_limiter.snapshot()}), 200
+
 # ------------------ API Endpoints ------------------
 
+def _busy_response():
+    # Password hashing queue is saturated; ask the client to back off briefly
+    response = jsonify({"message": "Server is busy, please retry shortly"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
 @app.route("/api/status", methods=["GET"])
 def get_status():
     try:
@@ -50,54 +262,123 @@ def get_status():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+MAX_PAGE_SIZE = 1000
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def wants_ndjson():
+    return request.args.get("format") == "ndjson" or request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def ndjson_response(rows):
+    # One JSON document per line, produced lazily from a DB cursor
+    def generate():
+        for row in rows:
+            yield json_dumps(row) + b"\n"
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def paged_response(rows, limit):
+    # Body stays a plain list; the cursor for the next page travels in a header
+    response = jsonify(rows)
+    if len(rows) == limit:
+        response.headers["X-Next-After-Id"] = str(rows[-1]["id"])
+    return response
+
+
+def _safe_user(u):
+    # Only expose safe fields
+    return {
+        "id": u["id"],
+        "username": u["username"],
+        "email": u.get("email", ""),
+        "created_at": u.get("created_at", ""),
+        "last_activity": u.get("last_activity", "")
+    }
+
+
 @app.route("/api/users", methods=["GET"])
 def api_get_users():
+    after_id = request.args.get("after_id", default=0, type=int)
+    limit = min(max(request.args.get("limit", default=100, type=int), 1), MAX_PAGE_SIZE)
     try:
-        users = db.get_all_users()
-        # Only expose safe fields
-        safe_users = [
-            {
-                "id": u["id"],
-                "username": u["username"],
-                "email": u.get("email", ""),
-                "created_at": u.get("created_at", ""),
-                "last_activity": u.get("last_activity", "")
-            }
-            for u in users
-        ]
-        return jsonify(safe_users), 200
+        if wants_ndjson():
+            return ndjson_response(_safe_user(u) for u in db.iter_users(after_id))
+        users = [_safe_user(u) for u in db.get_users_page(after_id, limit)]
+        return paged_response(users, limit), 200
     except Exception as e:
         app_logger.error(f"Error getting all users: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
+MAX_BATCH_USERS = 500
+
+
+def _split_param(name):
+    raw = request.args.get(name, "")
+    return [part.strip() for part in raw.split(",") if part.strip()]
+
+
+@app.route("/api/users/batch", methods=["GET"])
+@require_auth
+def api_get_users_batch():
+    # ?ids=1,2,3 or ?handles=name#0001,other#0420 -> compact profiles in one round trip
+    raw_ids = _split_param("ids")
+    handles = _split_param("handles")
+    if not raw_ids and not handles:
+        return jsonify({"message": "ids or handles is required"}), 400
+    if len(raw_ids) + len(handles) > MAX_BATCH_USERS:
+        return jsonify({"message": f"At most {MAX_BATCH_USERS} users per request"}), 400
+    try:
+        ids = list(dict.fromkeys(int(i) for i in raw_ids))
+    except ValueError:
+        return jsonify({"message": "ids must be integers"}), 400
+
+    try:
+        profiles = sessions.identities(ids, db.get_users_by_ids)
+        if handles:
+            for user in db.get_users_by_handles(dict.fromkeys(handles)):
+                profiles[user["id"]] = sessions.remember(user)
+        return jsonify(list(profiles.values())), 200
+    except Exception as e:
+        app_logger.error(f"Error in batch user lookup: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/users/search", methods=["GET"])
+@require_auth
+def api_search_users():
+    # Typeahead for the Add Friend flow: case-insensitive prefix of "username#tag"
+    query = request.args.get("q", "").strip()
+    limit = min(max(request.args.get("limit", default=10, type=int), 1), 50)
+    if not query:
+        return jsonify([]), 200
+    return jsonify(username_index.search(query, limit)), 200
+
+
 @app.route("/api/users/online", methods=["GET"])
 def api_get_online_users():
     try:
-        online_users = db.get_online_users()
-        safe_users = [
-            {"id": u["id"], "username": u["username"], "last_activity": u.get("last_activity", "")}
-            for u in online_users
-        ]
-        return jsonify(safe_users), 200
+        if online_users_cache["expires"] < time.monotonic():
+            online_users_cache["users"] = [
+                {"id": u["id"], "username": u["username"], "last_activity": u.get("last_activity", "")}
+                for u in db.get_online_users()
+            ]
+            online_users_cache["expires"] = time.monotonic() + ONLINE_USERS_TTL
+        return jsonify(online_users_cache["users"]), 200
     except Exception as e:
         app_logger.error(f"Error getting online users: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/api/users/activity", methods=["POST"])
+@require_auth
 def api_update_user_activity():
-    data = request.get_json(force=True, silent=True) or {}
-    user_id = data.get('user_id')
-
-    if not user_id:
-        return jsonify({"message": "User ID is required"}), 400
-
+    user_id = g.user["id"]
     try:
-        if db.update_activity(user_id):
-            return jsonify({"message": "Activity updated"}), 200
-        else:
-            return jsonify({"message": "User ID not found"}), 404
+        db.update_activity(user_id)
+        event_bus.publish("presence", {"user_id": user_id})
+        return jsonify({"message": "Activity updated"}), 200
     except Exception as e:
         app_logger.error(f"Error updating user activity for {user_id}: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
@@ -105,7 +386,7 @@ def api_update_user_activity():
 
 @app.route("/api/register", methods=["POST"])
 def api_register_user():
-    data = request.get_json(force=True, silent=True) or {}
+    data = read_body()
     username = data.get('username')
     password = data.get('password')
     email = data.get('email')
@@ -117,16 +398,20 @@ def api_register_user():
         user_id = db.register_user(username, password, email)
         if user_id:
             db.update_activity(user_id)
+            user = db.get_user_by_id(user_id)
+            event_bus.publish("user", {"id": user_id, "username": user["username"], "tag": user["tag"]})
             return jsonify({"message": "User registered successfully", "user_id": user_id}), 201
         else:
             return jsonify({"message": "Username already taken"}), 409
+    except VerifierBusy:
+        return _busy_response()
     except Exception as e:
         app_logger.error(f"Error during registration: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/login", methods=["POST"])
 def api_login_user():
-    data = request.get_json(force=True, silent=True) or {}
+    data = read_body()
     username = data.get('username')
     password = data.get('password')
 
@@ -137,37 +422,52 @@ def api_login_user():
         user = db.authenticate_user(username, password)
         if user:
             db.update_activity(user['id'])
-
-            # ساخت رشته‌ی ترکیبی username#tag
+            sessions.remember(user)
+            event_bus.publish("presence", {"user_id": user['id']})
 
             return jsonify({
                 "message": "Login successful",
                 "user_id": user['id'],
-                "user_tag": user['tag']
+                "user_tag": user['tag'],
+                "token": sessions.issue(user['id'])
             }), 200
         else:
             return jsonify({"message": "Invalid username or password"}), 401
+    except AmbiguousUsername:
+        return jsonify({"message": "Several accounts use this username; log in with username#tag"}), 409
+    except VerifierBusy:
+        return _busy_response()
     except Exception as e:
         app_logger.error(f"Error during login: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/logout", methods=["POST"])
+@require_auth
+def api_logout_user():
+    sessions.revoke(request.headers["Authorization"][7:].strip())
+    return jsonify({"message": "Logged out"}), 200
+
 @app.route("/api/messages/send", methods=["POST"])
+@require_auth
 def api_send_message():
-    data = request.get_json(force=True, silent=True) or {}
-    sender_id = data.get('sender_id')
-    message = data.get('message')
-
-    if not sender_id or not message:
-        return jsonify({"message": "Sender ID and message are required"}), 400
+    data = read_body()
+    sender_id = g.user["id"]
+    message = data.get('message') or ""
+    room_id = data.get('room_id', GLOBAL_ROOM_ID)
+    attachment, attachment_name, error = read_attachment(data)
+
+    if error:
+        return jsonify({"message": error}), 400
+    if not message and not attachment:
+        return jsonify({"message": "Message is required"}), 400
+    if not isinstance(room_id, int) or not db.is_room_member(room_id, sender_id):
+        return jsonify({"message": "You are not a member of this room."}), 403
 
     try:
-        user = db.get_user_by_id(sender_id)
-        if not user:
-            return jsonify({"message": "Sender ID does not exist."}), 404
-
-        message_id = db.add_message(sender_id, message)
+        message_id = db.add_message(sender_id, message, room_id, attachment, attachment_name)
         db.update_activity(sender_id)
-        return jsonify({"message": "Message sent", "message_id": message_id}), 200
+        event_bus.publish("message", {"room_id": room_id, "id": message_id})
+        return jsonify({"message": "Message sent", "message_id": message_id, "room_id": room_id}), 200
     except Exception as e:
         app_logger.error(f"Error sending message: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
@@ -176,46 +476,195 @@ def api_send_message():
 @app.route("/api/messages", methods=["GET"])
 def api_get_messages():
     last_id = request.args.get('last_id', 0, type=int)
+    room_id = request.args.get('room_id', GLOBAL_ROOM_ID, type=int)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), MAX_PAGE_SIZE)
+    # ?before_id=N pages backwards through history (the newest `limit` messages older than N)
+    before_id = request.args.get('before_id', type=int)
+
+    if room_id != GLOBAL_ROOM_ID and (g.user is None or not db.is_room_member(room_id, g.user["id"])):
+        return jsonify({"message": "You are not a member of this room."}), 403
+    if before_id is not None:
+        try:
+            return jsonify(db.get_messages_before(before_id, limit=limit, room_id=room_id)), 200
+        except Exception as e:
+            app_logger.error(f"Error getting older messages: {e}", exc_info=True)
+            return jsonify({"error": str(e)}), 500
+    # Nothing new in this room: answer from memory without touching the DB
+    if room_latest(room_id) <= last_id:
+        return jsonify([]), 200
+
     try:
-        messages = db.get_recent_messages(since_id=last_id)
+        messages = db.get_recent_messages(since_id=last_id, limit=limit, room_id=room_id)
         return jsonify(messages), 200
     except Exception as e:
         app_logger.error(f"Error getting messages: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
+# ------------- Attachments -------------
+
+def read_attachment(data):
+    # {"attachment": {"hash": "<sha256>", "name": "photo.png"}} -> (hash, name, error)
+    attachment = data.get("attachment")
+    if not attachment:
+        return None, None, None
+    if not isinstance(attachment, dict) or not blob_store.exists(attachment.get("hash")):
+        return None, None, "Attachment not found; upload it to /api/blobs first."
+    name = str(attachment.get("name") or "")[:255] or None
+    return attachment["hash"], name, None
+
+
+@app.route("/api/blobs", methods=["POST", "PUT"])
+@require_auth
+def api_upload_blob():
+    # Raw request body (optionally chunked transfer-encoding), streamed straight to disk
+    try:
+        digest, size, created = blob_store.save_stream(request.stream)
+    except BlobTooLarge as e:
+        return jsonify({"message": str(e)}), 413
+    except Exception as e:
+        app_logger.error(f"Error storing upload: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+    db.add_blob(digest, size, request.mimetype or None)
+    return jsonify({"hash": digest, "size": size, "deduplicated": not created}), 201 if created else 200
+
+
+# Uploader-supplied types that are safe to render inline; anything else (text/html,
+# image/svg+xml, ...) is served as a download so it cannot run script on our origin
+INLINE_BLOB_TYPES = {
+    "image/png", "image/jpeg", "image/gif", "image/webp", "image/bmp",
+    "audio/mpeg", "audio/ogg", "audio/wav", "video/mp4", "video/webm", "text/plain",
+}
+
+
+@app.route("/api/blobs/<digest>", methods=["GET"])
+@require_auth
+def api_download_blob(digest):
+    if not blob_store.exists(digest):
+        return jsonify({"message": "Blob not found"}), 404
+    blob = db.get_blob(digest) or {}
+    name = request.args.get("name")
+    content_type = blob.get("content_type") or "application/octet-stream"
+    inline = content_type in INLINE_BLOB_TYPES
+    # conditional=True gives Range/If-None-Match support; the file is handed to
+    # wsgi.file_wrapper so capable servers use sendfile() instead of copying
+    response = send_file(
+        blob_store.path_for(digest),
+        mimetype=content_type if inline else "application/octet-stream",
+        as_attachment=bool(name) or not inline,
+        download_name=name or digest,
+        conditional=True,
+        etag=digest,
+        max_age=365 * 24 * 3600
+    )
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    # Blobs need a bearer token: only the caller's own cache may keep them, never a shared one
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+
+# ------------- Rooms -------------
+
+MAX_WAIT_SECONDS = 30
+
+
+@app.route("/api/rooms", methods=["GET"])
+@require_auth
+def api_get_rooms():
+    rooms = db.get_user_rooms(g.user["id"])
+    for room in rooms:
+        room["latest_id"] = room_latest(room["id"])
+    return jsonify(rooms), 200
+
+
+@app.route("/api/rooms", methods=["POST"])
+@require_auth
+def api_create_room():
+    name = str(read_body().get("name", "")).strip()
+    if not name:
+        return jsonify({"message": "Room name is required"}), 400
+    try:
+        room_id = db.create_room(name, g.user["id"])
+        if room_id is None:
+            return jsonify({"message": "Room name already taken"}), 409
+        return jsonify({"message": "Room created", "room_id": room_id}), 201
+    except Exception as e:
+        app_logger.error(f"Error creating room {name}: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/rooms/<int:room_id>/join", methods=["POST"])
+@require_auth
+def api_join_room(room_id):
+    if not db.get_room(room_id):
+        return jsonify({"message": "Room not found"}), 404
+    if room_id != GLOBAL_ROOM_ID:
+        db.join_room(room_id, g.user["id"])
+    return jsonify({"message": "Joined room", "latest_id": room_latest(room_id)}), 200
+
+
+@app.route("/api/rooms/<int:room_id>/leave", methods=["POST"])
+@require_auth
+def api_leave_room(room_id):
+    if room_id == GLOBAL_ROOM_ID:
+        return jsonify({"message": "You cannot leave the general room"}), 400
+    db.leave_room(room_id, g.user["id"])
+    return jsonify({"message": "Left room"}), 200
+
+
+@app.route("/api/rooms/wait", methods=["GET"])
+@require_auth
+def api_wait_rooms():
+    # Long-poll: ?cursors=1:120,7:45 returns as soon as any of those rooms has newer messages.
+    # ?inbox=<last private message id> also wakes on new DMs to or from the caller.
+    try:
+        cursors = {}
+        for part in _split_param("cursors"):
+            room, _, last_id = part.partition(":")
+            cursors[int(room)] = int(last_id or 0)
+        inbox_since = request.args.get("inbox", type=int)
+    except ValueError:
+        return jsonify({"message": "cursors must look like room_id:last_id,..."}), 400
+    if not cursors and inbox_since is None:
+        return jsonify({"message": "cursors or inbox is required"}), 400
+
+    user_id = g.user["id"]
+    cursors = {room: last_id for room, last_id in cursors.items() if db.is_room_member(room, user_id)}
+    inbox_key = ("inbox", user_id)
+    if inbox_since is not None:
+        cursors[inbox_key] = inbox_since
+    timeout = min(max(request.args.get("timeout", 25, type=float), 0), MAX_WAIT_SECONDS)
+    changed = room_notifier.wait(cursors, timeout) if cursors else {}
+    inbox_latest = changed.pop(inbox_key, None)
+    return jsonify({"rooms": changed, "inbox": inbox_latest}), 200
+
+
 # ------------- Friend System APIs -------------
 
 @app.route("/api/friends/requests", methods=["GET"])
+@require_auth
 def get_friend_requests_api():
-    user_id = request.args.get("user_id")
-    user_tag = request.args.get("user_tag")
-    if not user_id or not user_id.isdigit():
-        return jsonify({"message": "Missing or invalid user_id"}), 400
-    user_id = int(user_id)
+    user_id = g.user["id"]
     try:
         requests = db.get_pending_friend_requests(user_id)
-        app_logger.info(f"Friend requests for user_id={user_tag}: {requests}")
         return jsonify(requests), 200
     except Exception as e:
         app_logger.error(f"Error getting friend requests for user {user_id}: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/friends/request", methods=["POST"])
+@require_auth
 def send_friend_request():
-    data = request.get_json()
-    from_user_identifier = data.get("from_user_id")  # این رشته است، مثلاً "t1#1111"
-    to_username_tag = data.get("to_identifier")      # این هم رشته است مثل "t3#1111"
+    data = read_body()
+    from_user_identifier = g.user["handle"]
+    to_username_tag = data.get("to_identifier")      # رشته مثل "t3#1111"
 
-    if not from_user_identifier or not to_username_tag:
+    if not to_username_tag:
         return jsonify({"message": "Missing parameters."}), 400
 
-    # تبدیل شناسه رشته ای مبدا به عدد
-    from_user = db.get_user_by_username_tag(from_user_identifier)
-    if not from_user:
-        return jsonify({"message": "From user not found."}), 404
-
-    from_user_id = from_user['id']
+    from_user_id = g.user["id"]
 
     # تبدیل شناسه رشته ای مقصد به عدد
     to_user = db.get_user_by_username_tag(to_username_tag)
@@ -227,10 +676,8 @@ def send_friend_request():
     if from_user_id == to_user_id:
         return jsonify({"message": "You cannot add yourself as a friend."}), 400
 
-    to_user_tag = db.get_username_tag_by_id(to_user_id)
-
     try:
-        success, message = db.send_friend_request(from_user_id, to_user_tag)
+        success, message = db.send_friend_request(from_user_id, to_user_id)
         if success:
             return jsonify({"message": message}), 200
         else:
@@ -240,22 +687,23 @@ def send_friend_request():
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/friends/respond", methods=["POST"])
+@require_auth
 def respond_friend_request():
-    data = request.get_json(force=True, silent=True) or {}
-    requester = db.get_user_by_username_tag(data.get("requester_id"))
-    addressee = db.get_user_by_username_tag(data.get("addressee_id"))
+    data = read_body()
+    requester = db.get_user_by_username_tag(str(data.get("requester_id", "")))
     accept = data.get("accept")
 
-    if not requester or not addressee or accept is None:
-        app_logger.info(f"Received friend respond: {data}")
-        return jsonify({"error": "requester_id, addressee_id and accept(boolean) are required"}), 400
+    if not requester or accept is None:
+        return jsonify({"error": "requester_id and accept(boolean) are required"}), 400
 
     requester_id = requester["id"]
-    addressee_id = addressee["id"]
+    addressee_id = g.user["id"]
 
     try:
         success, msg = db.respond_to_friend_request(requester_id, addressee_id, accept=bool(accept))
         if success:
+            if accept:
+                event_bus.publish("friend", {"action": "added", "a": requester_id, "b": addressee_id})
             return jsonify({"message": msg}), 200
         else:
             return jsonify({"error": msg}), 400
@@ -265,13 +713,11 @@ def respond_friend_request():
 
 
 @app.route("/api/friends/all", methods=["GET"])
+@require_auth
 def get_all_friends():
-    user_id = request.args.get("user_id")
-    if not user_id:
-        return jsonify({"message": "Missing user_id"}), 400
-
+    user_id = g.user["id"]
     try:
-        all_friends = db.get_friends(int(user_id))
+        all_friends = db.get_friends(user_id)
         return jsonify(all_friends), 200
     except Exception as e:
         app_logger.error(f"Error getting all friends for user {user_id}: {e}", exc_info=True)
@@ -279,52 +725,97 @@ def get_all_friends():
 
 
 @app.route("/api/friends/online", methods=["GET"])
+@require_auth
 def get_online_friends():
-    user_id = request.args.get("user_id")
-    if not user_id:
-        return jsonify({"message": "Missing user_id"}), 400
-
+    user_id = g.user["id"]
     try:
-        online_friends = db.get_online_friends(int(user_id))
+        online_friends = db.get_online_friends(user_id)
         return jsonify(online_friends), 200
     except Exception as e:
         app_logger.error(f"Error getting online friends for user {user_id}: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/friends/overview", methods=["GET"])
+@require_auth
+def get_friends_overview():
+    # Everything the friends page shows at login, in one round trip
+    user_id = g.user["id"]
+    try:
+        return jsonify({
+            "online": db.get_online_friends(user_id),
+            "friends": db.get_friends(user_id),
+            "requests": db.get_pending_friend_requests(user_id)
+        }), 200
+    except Exception as e:
+        app_logger.error(f"Error getting friends overview for user {user_id}: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route("/api/friends/remove", methods=["POST"])
+@require_auth
 def remove_friend():
-    data = request.get_json(force=True, silent=True) or {}
-    user_id = data.get("user_id")
-    friend_id = data.get("friend_id")
-
-    if not user_id or not friend_id:
-        return jsonify({"error": "user_id and friend_id are required"}), 400
+    data = read_body()
+    user_id = g.user["id"]
+    try:
+        friend_id = int(data.get("friend_id"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "friend_id must be an integer"}), 400
 
     try:
         db.remove_friend(user_id, friend_id)
+        event_bus.publish("friend", {"action": "removed", "a": user_id, "b": friend_id})
         return jsonify({"message": "Friend removed"}), 200
     except Exception as e:
         app_logger.error(f"Error removing friend {friend_id} for user {user_id}: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/friends/suggestions", methods=["GET"])
+@require_auth
+def get_friend_suggestions():
+    user_id = g.user["id"]
+    limit = min(max(request.args.get("limit", default=10, type=int), 1), friend_graph.top_k)
+    try:
+        ranked = friend_graph.suggestions(user_id, limit)
+        profiles = sessions.identities([candidate for candidate, _ in ranked], db.get_users_by_ids)
+        suggestions = [
+            dict(profiles[candidate], mutual_friends=mutual)
+            for candidate, mutual in ranked if candidate in profiles
+        ]
+        return jsonify(suggestions), 200
+    except Exception as e:
+        app_logger.error(f"Error getting friend suggestions for user {user_id}: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
 # ------------------------ Private Messaging API ------------------------
 
 @app.route("/api/private/send", methods=["POST"])
+@require_auth
 def send_private_message_api():
-    data = request.get_json(force=True, silent=True) or {}
-    sender_id = data.get("sender_id")
-    receiver_id = data.get("receiver_id")
-    message = data.get("message")
-
-    if not sender_id or not receiver_id or not message:
-        return jsonify({"error": "sender_id, receiver_id and message are required"}), 400
+    data = read_body()
+    sender_id = g.user["id"]
+    message = data.get("message") or ""
+    attachment, attachment_name, error = read_attachment(data)
+
+    if error:
+        return jsonify({"error": error}), 400
+    if not data.get("receiver_id") or not (message or attachment):
+        return jsonify({"error": "receiver_id and message are required"}), 400
+    try:
+        receiver_id = int(data.get("receiver_id"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "receiver_id must be an integer"}), 400
 
     try:
-        success, msg = db.send_private_message(sender_id, receiver_id, message)
+        success, msg, message_id = db.send_private_message(
+            sender_id, receiver_id, message, attachment, attachment_name
+        )
         if success:
             db.update_activity(sender_id)
-            return jsonify({"message": msg}), 200
+            event_bus.publish("private_message", {
+                "id": message_id, "sender_id": sender_id, "receiver_id": receiver_id
+            })
+            return jsonify({"message": msg, "message_id": message_id}), 200
         else:
             return jsonify({"error": msg}), 403
     except Exception as e:
@@ -333,29 +824,89 @@ def send_private_message_api():
 
 
 @app.route("/api/private/messages", methods=["GET"])
+@require_auth
 def get_private_messages_api():
-    user1_id = request.args.get("user1_id", type=int)
+    user1_id = g.user["id"]
     user2_id = request.args.get("user2_id", type=int)
     limit = request.args.get("limit", default=100, type=int)
+    # ?before_id=N returns the page of older messages that precede N
+    before_id = request.args.get("before_id", type=int)
 
-    if not user1_id or not user2_id:
-        return jsonify({"error": "user1_id and user2_id are required"}), 400
+    if not user2_id:
+        return jsonify({"error": "user2_id is required"}), 400
 
     try:
-        messages = db.get_private_messages(user1_id, user2_id, limit=limit)
+        messages = db.get_private_messages(user1_id, user2_id, limit=limit, before_id=before_id)
         return jsonify(messages), 200
     except Exception as e:
         app_logger.error(f"Error fetching private messages: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/private/last", methods=["GET"])
-def get_last_messages_api():
-    user_id = request.args.get("user_id", type=int)
+@app.route("/api/private/inbox", methods=["GET"])
+@require_auth
+def get_private_inbox_api():
+    # All DMs to or from the caller after since_id, across every conversation
+    user_id = g.user["id"]
+    since_id = request.args.get("since_id", default=0, type=int)
+    limit = min(max(request.args.get("limit", default=200, type=int), 1), MAX_PAGE_SIZE)
+    try:
+        messages = db.get_private_inbox(user_id, since_id, limit)
+        last_id = messages[-1]["id"] if messages else since_id
+        return jsonify({
+            "messages": messages,
+            "last_id": last_id,
+            "has_more": len(messages) == limit,
+            "unread": db.get_unread_counts(user_id)
+        }), 200
+    except Exception as e:
+        app_logger.error(f"Error fetching private inbox: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
 
-    if not user_id:
-        return jsonify({"error": "user_id is required"}), 400
 
+@app.route("/api/unread", methods=["GET"])
+@require_auth
+def get_unread_api():
+    user_id = g.user["id"]
+    try:
+        counts = db.get_unread_counts(user_id)
+        return jsonify({"unread": counts, "total": sum(counts.values())}), 200
+    except Exception as e:
+        app_logger.error(f"Error getting unread counts for user {user_id}: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/read", methods=["POST"])
+@require_auth
+def mark_read_api():
+    # Batched acknowledgements: {"acks": [{"conversation": "dm:5", "last_read_id": 42}, ...]}
+    data = read_body()
+    acks = data.get("acks")
+    if not isinstance(acks, list) or not all(isinstance(a, dict) for a in acks):
+        return jsonify({"error": "acks must be a list of {conversation, last_read_id}"}), 400
+
+    user_id = g.user["id"]
+    acks = acks[:MAX_PAGE_SIZE]
+    # A room cursor would report that room's unread count, so it needs membership
+    for ack in acks:
+        kind, _, target = str(ack.get("conversation", "")).partition(":")
+        if kind == "room" and target.isdigit() and not db.is_room_member(int(target), user_id):
+            return jsonify({"message": f"You are not a member of room {target}"}), 403
+    try:
+        db.mark_read(user_id, acks)
+        counts = db.get_unread_counts(user_id)
+        return jsonify({"unread": counts, "total": sum(counts.values())}), 200
+    except (TypeError, ValueError):
+        return jsonify({"error": "last_read_id must be an integer"}), 400
+    except Exception as e:
+        app_logger.error(f"Error marking messages read for user {user_id}: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/private/last", methods=["GET"])
+@require_auth
+def get_last_messages_api():
+    user_id = g.user["id"]
     try:
         convos = db.get_last_messages_with_friends(user_id)
         return jsonify(convos), 200
@@ -365,6 +916,8 @@ def get_last_messages_api():
 
 # ----------------- Admin Panel GUI -----------------
 
+ADMIN_PAGE_SIZE = 500
+
 class AdminPanel(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -376,6 +929,9 @@ class AdminPanel(ctk.CTk):
         self.protocol("WM_DELETE_WINDOW", self._on_close)
 
         self.is_running = True
+        # Keyset cursor of the listing currently shown, for "Next page"
+        self._page_loader = None
+        self._page_after_id = 0
 
         ctk.set_appearance_mode("Dark")
         ctk.set_default_color_theme("blue")
@@ -449,6 +1005,14 @@ class AdminPanel(ctk.CTk):
         )
         self.data_text.pack(fill="both", expand=True, padx=5, pady=5)
 
+        self.next_page_btn = ctk.CTkButton(
+            master=self.main_panel,
+            text="Next page ▶",
+            command=self._show_next_page,
+            state="disabled"
+        )
+        self.next_page_btn.pack(anchor="e", padx=5, pady=(0, 5))
+
         # Status bar
         self.status_bar = ctk.CTkLabel(
             master=self,
@@ -471,20 +1035,28 @@ class AdminPanel(ctk.CTk):
             self.status_bar.configure(text=f"🔴 Server error: {e}")
             app_logger.error(f"Error updating status in Admin Panel: {e}", exc_info=True)
 
+    def _show_page(self, loader, after_id=0):
+        # loader(after_id) fetches and displays one page, returning its rows
+        self._page_loader = loader
+        rows = loader(after_id)
+        if len(rows) == ADMIN_PAGE_SIZE:
+            self._page_after_id = rows[-1]["id"]
+            self.next_page_btn.configure(state="normal")
+        else:
+            self.next_page_btn.configure(state="disabled")
+
+    def _show_next_page(self):
+        if self._page_loader:
+            self._show_page(self._page_loader, self._page_after_id)
+
+    def _load_users_page(self, after_id):
+        users = [_safe_user(u) for u in db.get_users_page(after_id, ADMIN_PAGE_SIZE)]
+        self._display_data(users, ["id", "username", "email", "created_at", "last_activity"], "All Users")
+        return users
+
     def _show_users(self):
         try:
-            users = db.get_all_users()
-            display_users = [
-                {
-                    "id": u["id"],
-                    "username": u["username"],
-                    "email": u.get("email", ""),
-                    "created_at": u.get("created_at", ""),
-                    "last_activity": u.get("last_activity", "")
-                }
-                for u in users
-            ]
-            self._display_data(display_users, ["id", "username", "email", "created_at", "last_activity"], "All Users")
+            self._show_page(self._load_users_page)
         except Exception as e:
             self._display_error(f"Error loading users: {e}")
 
@@ -510,17 +1082,25 @@ class AdminPanel(ctk.CTk):
         except Exception as e:
             self._display_error(f"Error loading stats: {e}")
 
+    def _load_friend_requests_page(self, after_id):
+        requests = db.get_all_pending_friend_requests_page(after_id, ADMIN_PAGE_SIZE)
+        self._display_data(requests, ["requester", "addressee", "requested_at"], "Pending Friend Requests")
+        return requests
+
     def _show_friend_requests(self):
         try:
-            requests = db.get_all_pending_friend_requests()
-            self._display_data(requests, ["requester", "addressee", "requested_at"], "Pending Friend Requests")
+            self._show_page(self._load_friend_requests_page)
         except Exception as e:
             self._display_error(f"Error loading friend requests: {e}")
 
+    def _load_friends_page(self, after_id):
+        friends = db.get_all_friends_page(after_id, ADMIN_PAGE_SIZE)
+        self._display_data(friends, ["user1", "user2", "responded_at"], "Friends List")
+        return friends
+
     def _show_friends(self):
         try:
-            friends = db.get_all_friends()
-            self._display_data(friends, ["user_id", "friend_id", "since"], "Friends List")
+            self._show_page(self._load_friends_page)
         except Exception as e:
             self._display_error(f"Error loading friends list: {e}")
 
@@ -548,6 +1128,8 @@ class AdminPanel(ctk.CTk):
             self._append_data_text(line + "\n")
 
     def _set_data_text(self, text):
+        # Any new listing resets paging; _show_page re-enables it when there is more
+        self.next_page_btn.configure(state="disabled")
         self.data_text.configure(state="normal")
         self.data_text.delete("1.0", "end")
         self.data_text.insert("end", text)
@@ -611,5 +1193,7 @@ if __name__ == "__main__":
     except Exception as e:
         app_logger.critical(f"Error during Admin Panel GUI mainloop: {e}", exc_info=True)
 
+    db.password_verifier.shutdown()
+    event_bus.close()
     app_logger.info("Application exiting.")
     sys.exit(0)
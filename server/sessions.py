@@ -0,0 +1,111 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Shared secret for signing tokens. Set CHAT_SESSION_SECRET so tokens survive
+# restarts and are accepted by every worker; otherwise a random one is used.
+SESSION_SECRET = os.environ.get("CHAT_SESSION_SECRET", "").encode("utf-8") or os.urandom(32)
+SESSION_TTL = int(os.environ.get("CHAT_SESSION_TTL", 7 * 24 * 3600))
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+class SessionManager:
+    """
+    Stateless session tokens: "<user_id>.<expires>.<nonce>.<hmac>".
+    Validation is a single HMAC plus a set lookup, so no database access is needed.
+    Logged-out tokens go into an in-memory revocation set until they expire.
+    Resolved identities are kept in a small LRU cache keyed by user id.
+    """
+
+    def __init__(self, secret=SESSION_SECRET, ttl=SESSION_TTL, cache_size=10000):
+        self.secret = secret
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._revoked = {}  # signature -> expires
+        self._identities = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sign(self, payload):
+        return _b64(hmac.new(self.secret, payload.encode("ascii"), hashlib.sha256).digest())
+
+    def issue(self, user_id):
+        expires = int(time.time()) + self.ttl
+        payload = f"{int(user_id)}.{expires}.{_b64(os.urandom(8))}"
+        return f"{payload}.{self._sign(payload)}"
+
+    def validate(self, token):
+        """Return the user id the token was issued to, or None."""
+        if not token:
+            return None
+        try:
+            payload, signature = token.rsplit(".", 1)
+            user_id, expires, _ = payload.split(".")
+            user_id, expires = int(user_id), int(expires)
+        except ValueError:
+            return None
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        if expires < time.time() or signature in self._revoked:
+            return None
+        return user_id
+
+    def revoke(self, token):
+        try:
+            payload, signature = token.rsplit(".", 1)
+            expires = int(payload.split(".")[1])
+        except (ValueError, IndexError, AttributeError):
+            return
+        now = time.time()
+        with self._lock:
+            self._revoked[signature] = expires
+            # Drop entries that would be rejected by the expiry check anyway
+            for sig in [s for s, exp in self._revoked.items() if exp < now]:
+                del self._revoked[sig]
+
+    # ----------------- Identity cache ------------------
+    def remember(self, user):
+        identity = {
+            "id": user["id"],
+            "username": user["username"],
+            "tag": user["tag"],
+            "handle": f"{user['username']}#{user['tag']}",
+        }
+        with self._lock:
+            self._identities[identity["id"]] = identity
+            self._identities.move_to_end(identity["id"])
+            while len(self._identities) > self.cache_size:
+                self._identities.popitem(last=False)
+        return identity
+
+    def identity(self, user_id, loader):
+        """Cached identity for user_id; loader(user_id) is only called on a miss."""
+        with self._lock:
+            identity = self._identities.get(user_id)
+            if identity is not None:
+                self._identities.move_to_end(user_id)
+                return identity
+        user = loader(user_id)
+        return self.remember(user) if user else None
+
+    def identities(self, user_ids, bulk_loader):
+        """Cached identities for many ids; bulk_loader(missing_ids) fetches the misses in one go."""
+        found, missing = {}, []
+        with self._lock:
+            for user_id in user_ids:
+                identity = self._identities.get(user_id)
+                if identity is None:
+                    missing.append(user_id)
+                else:
+                    self._identities.move_to_end(user_id)
+                    found[user_id] = identity
+        if missing:
+            for user in bulk_loader(missing):
+                found[user["id"]] = self.remember(user)
+        return found
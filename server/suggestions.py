@@ -0,0 +1,123 @@
+import heapq
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict
+
+
+def _contains(arr, value):
+    pos = bisect_left(arr, value)
+    return pos < len(arr) and arr[pos] == value
+
+
+class FriendGraph:
+    """
+    "People you may know" from mutual-friend counts.
+
+    Adjacency is one sorted array('i') per user (4 bytes per edge end).
+    For users who asked for suggestions recently we keep the full mutual
+    count table in an LRU; edge changes patch those tables in place instead
+    of recomputing them, and the top-K list is re-derived lazily.
+    """
+
+    def __init__(self, cache_size=10000, top_k=20):
+        self.cache_size = cache_size
+        self.top_k = top_k
+        self._adj = {}
+        self._counts = OrderedDict()  # user_id -> Counter(candidate -> mutual friends)
+        self._top = {}                # user_id -> cached top-K list, dropped when counts change
+        self._lock = threading.Lock()
+
+    # ----------------- Graph ------------------
+    def build(self, edges):
+        """Bulk load from (user_a, user_b) pairs, e.g. ChatDatabase.iter_friend_edges()."""
+        lists = defaultdict(list)
+        for a, b in edges:
+            if a == b:
+                continue
+            lists[a].append(b)
+            lists[b].append(a)
+        adj = {user: array("i", sorted(set(friends))) for user, friends in lists.items()}
+        with self._lock:
+            self._adj = adj
+            self._counts.clear()
+            self._top.clear()
+
+    def friends(self, user_id):
+        return self._adj.get(user_id, array("i"))
+
+    def _link(self, a, b):
+        arr = self._adj.setdefault(a, array("i"))
+        pos = bisect_left(arr, b)
+        if pos < len(arr) and arr[pos] == b:
+            return False
+        arr.insert(pos, b)
+        return True
+
+    def _unlink(self, a, b):
+        arr = self._adj.get(a)
+        if arr is None:
+            return False
+        pos = bisect_left(arr, b)
+        if pos == len(arr) or arr[pos] != b:
+            return False
+        del arr[pos]
+        return True
+
+    def add_edge(self, a, b):
+        with self._lock:
+            if a == b or not self._link(a, b):
+                return
+            self._link(b, a)
+            self._apply_delta(a, b, +1)
+
+    def remove_edge(self, a, b):
+        with self._lock:
+            if not self._unlink(a, b):
+                return
+            self._unlink(b, a)
+            self._apply_delta(a, b, -1)
+
+    def _apply_delta(self, a, b, delta):
+        # a and b themselves: their candidate sets change shape, just recompute later
+        for user in (a, b):
+            self._counts.pop(user, None)
+            self._top.pop(user, None)
+        # Every cached friend x of a gains/loses b as a candidate through a (and vice versa)
+        for via, candidate in ((a, b), (b, a)):
+            for x in self.friends(via):
+                counts = self._counts.get(x)
+                if counts is None or x == candidate or _contains(self.friends(x), candidate):
+                    continue
+                counts[candidate] += delta
+                if counts[candidate] <= 0:
+                    del counts[candidate]
+                self._top.pop(x, None)
+
+    # ----------------- Suggestions ------------------
+    def _compute_counts(self, user_id):
+        mine = self.friends(user_id)
+        counts = Counter()
+        for friend in mine:
+            counts.update(self.friends(friend))
+        counts.pop(user_id, None)
+        for friend in mine:
+            counts.pop(friend, None)
+        return counts
+
+    def suggestions(self, user_id, limit=10):
+        """[(candidate_id, mutual_friend_count), ...] best first, ties by lower id."""
+        with self._lock:
+            top = self._top.get(user_id)
+            if top is None:
+                counts = self._counts.get(user_id)
+                if counts is None:
+                    counts = self._compute_counts(user_id)
+                    self._counts[user_id] = counts
+                    while len(self._counts) > self.cache_size:
+                        evicted, _ = self._counts.popitem(last=False)
+                        self._top.pop(evicted, None)
+                self._counts.move_to_end(user_id)
+                top = heapq.nsmallest(self.top_k, counts.items(), key=lambda kv: (-kv[1], kv[0]))
+                self._top[user_id] = top
+            return top[:limit]
@@ -0,0 +1,60 @@
+import threading
+from array import array
+from bisect import bisect_left
+
+
+class UsernameIndex:
+    """
+    In-memory prefix index over "username#tag" handles.
+    Keys are case-folded and kept sorted, so a prefix query is one bisect
+    plus a scan of at most `limit` keys: O(log n + k).
+    """
+
+    def __init__(self):
+        self._keys = []         # case-folded handles, sorted
+        self._ids = array("q")  # user id for each key
+        self._handles = []      # original-case handles, same order
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(username, tag):
+        return f"{username.casefold()}#{tag}"
+
+    def __len__(self):
+        return len(self._keys)
+
+    def build(self, users):
+        """(Re)build from an iterable of user rows, e.g. ChatDatabase.iter_users()."""
+        rows = sorted(
+            (self._key(u["username"], u["tag"]), u["id"], f"{u['username']}#{u['tag']}")
+            for u in users
+        )
+        with self._lock:
+            self._keys = [r[0] for r in rows]
+            self._ids = array("q", (r[1] for r in rows))
+            self._handles = [r[2] for r in rows]
+
+    def add(self, user_id, username, tag):
+        key = self._key(username, tag)
+        with self._lock:
+            pos = bisect_left(self._keys, key)
+            if pos < len(self._keys) and self._keys[pos] == key:
+                return
+            self._keys.insert(pos, key)
+            self._ids.insert(pos, user_id)
+            self._handles.insert(pos, f"{username}#{tag}")
+
+    def search(self, prefix, limit=10):
+        prefix = prefix.casefold()
+        if not prefix:
+            return []
+        with self._lock:
+            start = bisect_left(self._keys, prefix)
+            results = []
+            for pos in range(start, min(start + limit, len(self._keys))):
+                if not self._keys[pos].startswith(prefix):
+                    break
+                handle = self._handles[pos]
+                username, tag = handle.rsplit("#", 1)
+                results.append({"id": self._ids[pos], "username": username, "tag": tag, "handle": handle})
+        return results